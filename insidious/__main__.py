@@ -12,12 +12,46 @@ Arguments:
 
 Options:
     -r DIR, --reload DIR  Restart {DNAME} when source code files in DIR change.
+    -c NAME, --cache-codec NAME
+                          Compress new cached responses with "lz4" (default)
+                          or "zstd", which uses the last trained dictionary if
+                          any and needs the optional "zstd" dependencies.
+    -p FILE, --cache-policy FILE
+                          JSON file of cache times for kinds of extractions
+                          and URL patterns, see CachePolicy in
+                          extractors/cache.py.
+    -P N, --extract-processes N
+                          Fully extract videos in N worker processes instead
+                          of threads, to use multiple CPU cores.
+    --extract-timeout SECONDS
+                          Give up on extractions taking longer than this,
+                          120 seconds by default.
+    --hedge               When yt-dlp is unusually slow to get some video
+                          details, also ask an Invidious instance and use
+                          the first answer.
+    -w N, --workers N     Serve requests from N processes, keeping unfinished
+                          paginations in a database that they share. The
+                          disk cache budget is shared too, each process has
+                          its own in-memory caches.
+    --prefetch N          Fetch the next page of results in the background
+                          when few are left to show, at most N at a time.
+    --no-warm-up          Don't create extractor instances at startup, only
+                          when needed.
+    --benchmark-extraction IDS
+                          Compare video extraction throughput between threads
+                          and --extract-processes (default 4) processes for
+                          comma-separated video IDs, then exit.
+    --train-cache-dict    Train a zstd dictionary from the current cache
+                          contents, then exit.
+    --benchmark-cache     Compare compression ratio and decoding speed of the
+                          available codecs on the current cache, then exit.
     -h, --help            Show this help and exit.
     --version             Show the {DNAME} version and exit.
 """
 
 import os
 from pathlib import Path
+from typing import Any
 
 import docopt
 import uvicorn
@@ -25,9 +59,59 @@ import uvicorn
 from . import DISPLAY_NAME, NAME, __version__
 
 
+def export_options(args: dict[str, Any]) -> None:
+    """Pass options to the modules that read them from the environment."""
+    if args["--cache-codec"]:
+        os.environ["INSIDIOUS_CACHE_CODEC"] = args["--cache-codec"]
+
+    if args["--cache-policy"]:
+        path = Path(args["--cache-policy"]).resolve()
+        os.environ["INSIDIOUS_CACHE_POLICY"] = str(path)
+
+    if args["--extract-processes"]:
+        procs = args["--extract-processes"]
+        os.environ["INSIDIOUS_EXTRACT_PROCESSES"] = str(int(procs))
+
+    if args["--extract-timeout"]:
+        timeout = args["--extract-timeout"]
+        os.environ["INSIDIOUS_EXTRACT_TIMEOUT"] = str(float(timeout))
+
+    if args["--hedge"]:
+        os.environ["INSIDIOUS_HEDGE"] = "1"
+
+    if int(args["--workers"] or 1) > 1:
+        os.environ["INSIDIOUS_PAGINATION_STORE"] = "sqlite"
+
+    if args["--prefetch"]:
+        prefetch = args["--prefetch"]
+        os.environ["INSIDIOUS_PREFETCH"] = str(int(prefetch))
+
+    if args["--no-warm-up"]:
+        os.environ["INSIDIOUS_NO_WARM_UP"] = "1"
+
+
 def run() -> None:
     doc = (__doc__ or "").format(NAME=NAME, DNAME=DISPLAY_NAME)
     args = docopt.docopt(doc, version=__version__)
+    export_options(args)
+
+    if args["--benchmark-extraction"]:
+        from .extractors import ytdlp  # noqa: PLC0415
+
+        ids = args["--benchmark-extraction"].split(",")
+        ytdlp.benchmark_extraction(ids, ytdlp.EXTRACT_PROCESSES or 4)
+        return
+
+    if args["--train-cache-dict"] or args["--benchmark-cache"]:
+        # Only import now, the cache module reads options from the env
+        from .extractors import cache  # noqa: PLC0415
+
+        if args["--train-cache-dict"]:
+            cache.train_zstd_dictionary()
+        else:
+            cache.benchmark_codecs()
+        return
+
     dir = args["--reload"]
     if dir:
         dir = Path(dir).resolve()  # We change the cwd later, "." would break
@@ -39,6 +123,7 @@ def run() -> None:
         port = int(args["PORT"] or 3030),
         reload = bool(dir),
         reload_dirs = [str(dir)] if dir else [],
+        workers = int(args["--workers"] or 1),
         timeout_graceful_shutdown = 0,
     )
 
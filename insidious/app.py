@@ -11,19 +11,26 @@ import operator
 import os
 import re
 import shutil
-from collections.abc import AsyncGenerator, Awaitable, Callable
+from collections.abc import AsyncGenerator, Awaitable, Callable, Coroutine
 from contextlib import asynccontextmanager, suppress
 from dataclasses import dataclass, field
 from datetime import timedelta
-from functools import reduce
+from functools import partial, reduce
 from pathlib import Path
-from typing import TYPE_CHECKING, Annotated, ClassVar, Generic, TypeAlias
+from typing import TYPE_CHECKING, Annotated, Any, ClassVar, Generic, TypeAlias
 from urllib.parse import parse_qs, quote
 
 import backoff
 from fastapi.routing import APIRoute
 import jinja2
-from fastapi import BackgroundTasks, FastAPI, Query, Request, WebSocket
+from fastapi import (
+    BackgroundTasks,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+)
 from fastapi.datastructures import URL
 from fastapi.responses import (
     HTMLResponse,
@@ -36,10 +43,12 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from typing_extensions import override
 from watchfiles import awatch
+from yt_dlp.utils import DownloadError
 
 from . import DISPLAY_NAME, NAME
 from .extractors.data import (
     Channel,
+    ChannelNotFound,
     Comment,
     Comments,
     InPlaylist,
@@ -58,11 +67,19 @@ from .extractors.filters import (
     Sort,
     Type,
 )
+from .extractors.hedging import HEDGED
 from .extractors.piped import PIPED
 from .extractors.markup import yt_to_html
-from .extractors.ytdlp import YTDLP, CachedYoutubeDL
+from .extractors.ytdlp import YTDLP, CachedYoutubeDL, is_unavailable
 from .net import HTTPX_BACKOFF_ERRORS, HttpClient
-from .pagination import Pagination, RelatedPagination, T
+from .pagination import (
+    PLAYLIST_INDEX,
+    PREFETCHER,
+    Pagination,
+    RelatedPagination,
+    T,
+)
+from .resolver import PATH_KINDS, PathKind
 from .streaming import (
     HLS_ALT_MIME,
     HLS_MIME,
@@ -86,9 +103,16 @@ def create_background_job(coro: Awaitable[None]) -> asyncio.Task[None]:
 
 
 async def prune_cache() -> None:
+    # Prune in small steps off the event loop to not stall requests and
+    # streams, keep going at a short interval while over the size budget
     while True:
-        CachedYoutubeDL.prune_cache()
-        await asyncio.sleep(300)
+        more = await asyncio.to_thread(CachedYoutubeDL.prune_cache)
+        if not more:
+            await asyncio.to_thread(Pagination.store.prune)
+            PREFETCHER.prune()
+            await asyncio.to_thread(PLAYLIST_INDEX.prune)
+            await asyncio.to_thread(PATH_KINDS.prune)
+        await asyncio.sleep(0.5 if more else 60)
 
 
 async def watch_files() -> None:
@@ -106,6 +130,9 @@ async def watch_files() -> None:
 @asynccontextmanager
 async def lifespan(_: FastAPI) -> AsyncGenerator[None, None]:  # noqa: RUF029
     lifespan_tasks.append(create_background_job(prune_cache()))
+    if not os.getenv("INSIDIOUS_NO_WARM_UP"):
+        warm_up = asyncio.to_thread(YTDLP.warm_up)
+        lifespan_tasks.append(create_background_job(warm_up))
     lifespan_tasks.append(create_background_job(watch_files()))
     yield
     print("─" * shutil.get_terminal_size()[0])
@@ -214,6 +241,16 @@ class Page:
 class Paginated(Page, Generic[T]):
     pagination: Pagination[T]
 
+    @override
+    def _response_env(self, template: str) -> Response:
+        # No super() without arguments in slots dataclasses
+        response = Page._response_env(self, template)  # noqa: SLF001
+        # Run in a worker thread once the response is sent
+        response.background = BackgroundTasks()
+        response.background.add_task(self.pagination.save)
+        PREFETCHER.prefetch(self.pagination)
+        return response
+
 
 @dataclass(slots=True)
 class HomePage(Page):
@@ -325,8 +362,10 @@ async def results(
     request: Request, search_query: str = "", sp: str = "",
 ) -> Response:
     filter = SearchFilter.parse(sp)
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        pg.add(await YTDLP.search(search_query, filter, pg.page))
+    fetcher = partial(YTDLP.search, search_query, filter)
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(await pg.fetch())
 
     return SearchPage(request, search_query, pg, search_query, filter).response
 
@@ -359,8 +398,10 @@ def form_search(
 
 @app.get("/hashtag/{tag}")
 async def hashtag(request: Request, tag: str) -> Response:
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        pg.add(await YTDLP.hashtag(tag, pg.page))
+    fetcher = partial(YTDLP.hashtag, tag)
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(await pg.fetch())
 
     return SearchPage(request, f"#{tag}", pg).response
 
@@ -371,8 +412,10 @@ async def user(
     request: Request, id: str, tab: str | None = None, query: str = "",
     sort: str = "",
 ) -> Response:
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        pg.add(chan := await YTDLP.user(id, tab, query, pg.page, sort))
+    fetcher = partial(YTDLP.user, id, tab, query, sort=sort)
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(chan := await pg.fetch())
         page = ChannelPage(request, chan.title, pg, chan.tab, chan, query)
         return page.response
 
@@ -385,8 +428,10 @@ async def channel(
     request: Request, id: str, tab: str | None = None, query: str = "",
     sort: str = "",
 ) -> Response:
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        pg.add(chan := await YTDLP.channel(id, tab, query, pg.page, sort))
+    fetcher = partial(YTDLP.channel, id, tab, query, sort=sort)
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(chan := await pg.fetch())
         page = ChannelPage(request, chan.title, pg, chan.tab, chan, query)
         return page.response
 
@@ -395,8 +440,24 @@ async def channel(
 
 @app.get("/playlist")
 async def playlist(request: Request, list: str) -> Response:
-    if (pg := Pagination[InPlaylist].get(request).advance()).needs_more_data:
-        pg.add(pl := await YTDLP.playlist(list, pg.page))
+    async def fetcher(page: int) -> Playlist:
+        pl = await YTDLP.playlist(list, page)
+        await asyncio.to_thread(PLAYLIST_INDEX.learn, pl, page)
+        return pl
+
+    pg = await Pagination[InPlaylist].get(request, fetcher)
+    jumped = await asyncio.to_thread(PLAYLIST_INDEX.seek, pg, list)
+    if pg.advance().needs_more_data:
+        pg.add(pl := await pg.fetch())
+
+        if jumped and pg.finding:  # moved since, search from the start
+            assert pg.find_attr
+            await asyncio.to_thread(
+                PLAYLIST_INDEX.forget, list, pg.find_attr[1],
+            )
+            pg.reset()
+            pg.add(pl := await pg.fetch())
+
         return PlaylistPage(request, pl.title, pg, pl).response
 
     return PlaylistPage(request, None, pg).continuation
@@ -420,8 +481,10 @@ async def load_playlist_entry(request: Request, video_id: str) -> Response:
 
 @app.get("/featured_playlist")
 async def featured_playlist(request: Request, id: str) -> Response:
-    if (pg := Pagination[InPlaylist].get(request).advance()).needs_more_data:
-        pg.add(pl := await YTDLP.playlist(id, pg.page))
+    fetcher = partial(YTDLP.playlist, id)
+    pg = (await Pagination[InPlaylist].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(pl := await pg.fetch())
         return FeaturedSection(request, None, pg, pl.title, pl.url).response
 
     return FeaturedSection(request, None, pg).continuation
@@ -432,17 +495,18 @@ async def featured_tab(request: Request, url: str, title: str) -> Response:
     *_, api, id, tab = ([""] * 4) + URL(url).path.split("/")
     sort = next(iter(parse_qs(URL(url).query).get("sort", [])), "")
 
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        if api in {"", "c"}:
-            vids = await YTDLP.named_channel(id, tab, page=pg.page, sort=sort)
-        elif api == "channel":
-            vids = await YTDLP.channel(id, tab, page=pg.page, sort=sort)
-        elif api == "user":
-            vids = await YTDLP.user(id, tab, page=pg.page, sort=sort)
-        else:
-            raise ValueError(f"Invalid channel tab preview url {url!r}")
-
-        pg.add(vids)
+    if api in {"", "c"}:
+        fetcher = partial(YTDLP.named_channel, id, tab, "", sort=sort)
+    elif api == "channel":
+        fetcher = partial(YTDLP.channel, id, tab, "", sort=sort)
+    elif api == "user":
+        fetcher = partial(YTDLP.user, id, tab, "", sort=sort)
+    else:
+        raise ValueError(f"Invalid channel tab preview url {url!r}")
+
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(await pg.fetch())
         return FeaturedSection(request, None, pg, title, url).response
 
     return FeaturedSection(request, None, pg).continuation
@@ -506,24 +570,24 @@ async def watch(
 
 @app.get("/storyboard")
 async def storyboard(video_id: str) -> Response:
-    text = (await YTDLP.video(video_id)).webvtt_storyboard
+    video = await HEDGED.video(video_id, fields={"webvtt_storyboard"})
+    text = video.webvtt_storyboard
     return Response(text, media_type="text/vtt")
 
 
 @app.get("/chapters")
 async def chapters(video_id: str) -> Response:
-    text = (await YTDLP.video(video_id)).webvtt_chapters
+    video = await HEDGED.video(video_id, fields={"webvtt_chapters"})
+    text = video.webvtt_chapters
     return Response(text, media_type="text/vtt")
 
 
 @app.get("/related")
 async def related(request: Request) -> Response:
-    if (pg := RelatedPagination.get(request).advance()).needs_more_data:
+    pg = (await RelatedPagination.get(request)).advance()
+    if pg.needs_more_data:
         await pg.find()
 
-    for entry in pg.items:
-        entry.url = str(URL(entry.url).remove_query_params(("list", "index")))
-
     return RelatedPage(request, None, pg).response
 
 
@@ -544,7 +608,8 @@ async def comments(
     by_date: bool = False,
     continuation_id: str | None = None,
 ) -> Response:
-    if (pg := Pagination[Comment].get(request).advance()).needs_more_data:
+    pg = (await Pagination[Comment].get(request)).advance()
+    if pg.needs_more_data:
         with httpx_to_fastapi_errors():
             coms = await PIPED.comments(video_id, by_date, continuation_id)
 
@@ -590,7 +655,7 @@ async def make_variant_m3u8(
 async def make_subtitle_m3u8(
     request: Request, video_id: str, url: str,
 ) -> Response:
-    video = await YTDLP.video(video_id)
+    video = await HEDGED.video(video_id, fields={"duration"})
     url = f"{request.base_url}proxy/get?url={quote(url)}"
     text = subtitle_playlist(video.duration or 3600, url)
     return Response(text, media_type=HLS_MIME)
@@ -598,7 +663,8 @@ async def make_subtitle_m3u8(
 
 @app.get("/refresh_hls")
 async def refresh_hls(video_id: str) -> PlainTextResponse:
-    # googlevideo links have a ~6h lifetime
+    # googlevideo links have a ~6h lifetime. The player only asks after the
+    # current ones failed, so a cached video would just give them back
     video = await YTDLP.video(video_id, skip_cache=True)
     return PlainTextResponse(video.manifest_url)
 
@@ -738,9 +804,10 @@ async def named_channel(
     if name == "favicon.ico":
         return Response(status_code=404)
 
-    if (pg := Pagination[InSearch].get(request).advance()).needs_more_data:
-        chan = await YTDLP.named_channel(name, tab, query, pg.page, sort)
-        pg.add(chan)
+    fetcher = partial(YTDLP.named_channel, name, tab, query, sort=sort)
+    pg = (await Pagination[InSearch].get(request, fetcher)).advance()
+    if pg.needs_more_data:
+        pg.add(chan := await pg.fetch())
         page = ChannelPage(request, chan.title, pg, chan.tab, chan, query)
         return page.response
 
@@ -759,13 +826,30 @@ async def watch_or_channel(
     chan_params = {k: v for k, v in params.items() if k in chan_ok_params}
     exc: list[Exception] = []
 
-    tasks = (
-        asyncio.create_task(watch(request, path, **watch_params)),
-        asyncio.create_task(named_channel(request, path, **chan_params)),
-    )
-    while tasks:
+    def route(kind: PathKind) -> Coroutine[Any, Any, Response]:
+        if kind == PathKind.video:
+            return watch(request, path, **watch_params)
+        return named_channel(request, path, **chan_params)
+
+    # Go straight to what this path was found to be before
+    known = await asyncio.to_thread(PATH_KINDS.get, path)
+    if known == PathKind.none:
+        raise HTTPException(404, f"No video or channel found for {path}")
+    if known:
+        try:
+            return await route(known)
+        except (DownloadError, ChannelNotFound) as e:
+            log.info("Catch-all route no longer a %s: %r", known.value, e)
+            await asyncio.to_thread(PATH_KINDS.forget, path)
+
+    tasks = {
+        asyncio.create_task(route(kind)): kind
+        for kind in (PathKind.video, PathKind.channel)
+    }
+    pending = set(tasks)
+    while pending:
         done, pending = await asyncio.wait(
-            tasks, return_when=asyncio.FIRST_COMPLETED,
+            pending, return_when=asyncio.FIRST_COMPLETED,
         )
         for task in done:
             try:
@@ -774,9 +858,12 @@ async def watch_or_channel(
                 exc.append(e)
                 log.info("Catch-all route fail: %r", e)
             else:
-                for task in pending:
-                    task.cancel()
+                for loser in pending:
+                    loser.cancel()
+                await asyncio.to_thread(PATH_KINDS.learn, path, tasks[task])
                 return result
-        tasks = pending
 
+    if all(map(is_unavailable, exc)):
+        await asyncio.to_thread(PATH_KINDS.learn, path, PathKind.none)
+        raise HTTPException(404, f"No video or channel found for {path}")
     raise ExceptionGroup("All subroutes failed", exc)
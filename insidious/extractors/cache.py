@@ -0,0 +1,688 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import io
+import json
+import logging as log
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing, suppress
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from email.utils import parsedate_to_datetime
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, ClassVar, Generic, Self, TypeVar
+
+import appdirs
+from typing_extensions import override
+from yt_dlp.networking.common import (
+    Request as YtdlpRequest,
+    Response as YtdlpResponse,
+)
+
+from insidious import NAME
+
+from .codecs import Codecs, ZstdCodec, benchmark
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Iterator
+
+CACHE_DIR = Path(appdirs.user_cache_dir(NAME))
+CACHE_DIR.mkdir(parents=True, exist_ok=True)
+LEGACY_CACHE_FILE = re.compile(r"[0-9a-f]{32}")
+ZSTD_DICT_DIR = CACHE_DIR / "zstd-dicts"
+Codecs.setup(os.getenv("INSIDIOUS_CACHE_CODEC") or "lz4", ZSTD_DICT_DIR)
+
+# Parts of InnerTube API request bodies that vary between sessions or
+# requests without affecting responses, by endpoint ("*" for all of them)
+VOLATILE_INNERTUBE_FIELDS: dict[str, tuple[tuple[str, ...], ...]] = {
+    "*": (
+        ("context", "client", "visitorData"),
+        ("context", "client", "remoteHost"),
+        ("context", "client", "deviceExperimentId"),
+        ("context", "client", "rolloutToken"),
+        ("context", "client", "configInfo"),
+        ("context", "client", "originalUrl"),
+        ("context", "clickTracking"),
+        ("context", "adSignalsInfo"),
+        ("context", "request", "consistencyTokenJars"),
+        ("context", "request", "internalExperimentFlags"),
+    ),
+    # Continuation requests
+    "browse": (("clickTracking",),),
+    "next": (("clickTracking",),),
+    "search": (("clickTracking",),),
+}
+INNERTUBE_ENDPOINT = re.compile(r"/youtubei/v1/([\w/]+)")
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class _CompatibleBytesIO(io.BytesIO):
+    @override
+    def read(self, *_: Any, **__: Any) -> bytes:
+        return super().read()
+
+
+@dataclass(slots=True)
+class CachedResponse:
+    url: str
+    headers: dict[str, str]
+    status: int
+    reason: str
+    data: bytes
+    expire: float
+
+    @property
+    def size(self) -> int:
+        headers = sum(len(k) + len(v) for k, v in self.headers.items())
+        return len(self.data) + len(self.url) + headers
+
+    def to_ytdlp(self) -> YtdlpResponse:
+        return YtdlpResponse(
+            io.BytesIO(self.data),
+            self.url,
+            dict(self.headers),
+            self.status,
+            self.reason,
+        )
+
+    @classmethod
+    def from_ytdlp(cls, resp: YtdlpResponse, cache_time: float) -> Self:
+        # Response can only be read once, replace its consumed file object
+        resp.fp = _CompatibleBytesIO(data := resp.read())
+        return cls(
+            resp.url,
+            dict(resp.headers),
+            resp.status,
+            resp.reason or "",
+            data,
+            datetime.now(UTC).timestamp() + cache_time,
+        )
+
+
+@dataclass(slots=True)
+class CacheRule:
+    """Cache time for responses whose URL matches a regex.
+
+    With `upstream`, `Cache-Control` and `Expires` response headers take
+    precedence over `ttl` when present, capped to `max_ttl`.
+    """
+
+    url: re.Pattern[str]
+    ttl: float
+    upstream: bool = False
+    max_ttl: float = math.inf
+
+    @classmethod
+    def from_json(cls, data: dict[str, Any]) -> Self:
+        return cls(
+            re.compile(data["url"]),
+            data["ttl"],
+            data.get("upstream", False),
+            data.get("max_ttl", math.inf),
+        )
+
+
+@dataclass
+class CachePolicy:
+    """How long to cache responses and extraction results.
+
+    URL rules are checked in order and take precedence. Other responses
+    are cached for the time of the kind of extraction that requested them
+    (client methods like `search` or `playlist`), else `default`.
+    """
+
+    default: float = 60 * 60
+    kinds: dict[str, float] = field(default_factory=lambda: {
+        "search": 60 * 15,
+        "old_playlist": 60 * 60 * 24 * 3,
+    })
+    rules: list[CacheRule] = field(default_factory=lambda: [
+        # Versioned player JS never changes once published
+        CacheRule(
+            re.compile(r"^https://(www\.)?youtube\.com/s/player/"),
+            ttl = 60 * 60 * 24 * 7,
+            upstream = True,
+            max_ttl = 60 * 60 * 24 * 30,
+        ),
+    ])
+
+    def kind_ttl(self, kind: str) -> float:
+        return self.kinds.get(kind, self.default)
+
+    def rule_ttl(self, url: str, headers: dict[str, str]) -> float | None:
+        """Return the cache time of the first rule matching `url`, if any."""
+        for rule in self.rules:
+            if not rule.url.search(url):
+                continue
+            if rule.upstream and (ttl := upstream_ttl(headers)) is not None:
+                return min(ttl, rule.max_ttl)
+            return rule.ttl
+        return None
+
+    @classmethod
+    def load(cls, path: str | Path | None) -> Self:
+        """Load a JSON policy file, its rules come before the default ones.
+
+        Example: `{"default": 3600, "kinds": {"channel": 7200},
+        "rules": [{"url": "regex", "ttl": 60, "upstream": true}]}`
+        """
+        policy = cls()
+        if not path:
+            return policy
+
+        data = json.loads(Path(path).read_text("utf-8"))
+        policy.default = data.get("default", policy.default)
+        policy.kinds |= data.get("kinds", {})
+        policy.rules[:0] = map(CacheRule.from_json, data.get("rules", []))
+        return policy
+
+
+def upstream_ttl(headers: dict[str, str]) -> float | None:
+    """Return the cache time allowed by HTTP response headers, if any."""
+    headers = {k.lower(): v for k, v in headers.items()}
+    directives = {
+        name.strip().lower(): value.strip('" ')
+        for name, _, value in (
+            d.partition("=")
+            for d in headers.get("cache-control", "").split(",")
+        )
+    }
+
+    if {"no-store", "no-cache"} & directives.keys():
+        return 0
+    with suppress(KeyError, ValueError):
+        return max(0, int(directives["max-age"]))
+    if (expires := headers.get("expires")):
+        try:
+            date = parsedate_to_datetime(expires)
+        except (TypeError, ValueError):
+            return 0  # invalid dates mean already expired per RFC 9111
+        return max(0, date.timestamp() - datetime.now(UTC).timestamp())
+    return None
+
+
+@dataclass
+class MemoryCache(Generic[K, V]):
+    """Thread-safe LRU mapping with per-item expiration and a size budget."""
+
+    max_size: int
+    size: int = 0
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+
+    _items: OrderedDict[K, tuple[V, int, float]] = \
+        field(default_factory=OrderedDict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key: K) -> V | None:
+        with self._lock:
+            value, _, expire = self._items.get(key, (None, 0, math.inf))
+            if value is None:
+                self.misses += 1
+                return None
+
+            if datetime.now(UTC).timestamp() >= expire:
+                self._pop(key)
+                self.misses += 1
+                self.expirations += 1
+                return None
+
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(
+        self, key: K, value: V, size: int = 1, expire: float = math.inf,
+    ) -> None:
+        if size > self.max_size:
+            return
+
+        with self._lock:
+            self._pop(key)
+            self._items[key] = (value, size, expire)
+            self.size += size
+
+            while self.size > self.max_size:
+                self._pop(next(iter(self._items)))
+                self.evictions += 1
+
+    def pop(self, key: K) -> V | None:
+        with self._lock:
+            expire = self._items.get(key, (None, 0, math.inf))[2]
+            value = self._pop(key)
+            return value if datetime.now(UTC).timestamp() < expire else None
+
+    def prune_expired(self) -> int:
+        now = datetime.now(UTC).timestamp()
+        with self._lock:
+            expired = [
+                key for key, (_, _, exp) in self._items.items() if now >= exp
+            ]
+            for key in expired:
+                self._pop(key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def expire_at(self, key: K, expire: float) -> None:
+        with self._lock:
+            if key in self._items:
+                value, size, _ = self._items[key]
+                self._items[key] = (value, size, expire)
+
+    def _pop(self, key: K) -> V | None:
+        if (item := self._items.pop(key, None)) is None:
+            return None
+        self.size -= item[1]
+        return item[0]
+
+
+def normalize_body(url: str, data: bytes) -> bytes:
+    """Return a canonical form of InnerTube request bodies, other data as is.
+
+    Volatile fields are removed and keys sorted, so that logically identical
+    requests from different sessions share cached responses.
+    """
+    if not data or not (match := INNERTUBE_ENDPOINT.search(url)):
+        return data
+    try:
+        body = json.loads(data)
+    except ValueError:
+        return data
+    if not isinstance(body, dict):
+        return data
+
+    endpoint = match.group(1)
+    for path in (
+        *VOLATILE_INNERTUBE_FIELDS["*"],
+        *VOLATILE_INNERTUBE_FIELDS.get(endpoint, ()),
+    ):
+        parent = body
+        for part in path[:-1]:
+            parent = parent.get(part)
+            if not isinstance(parent, dict):
+                break
+        else:
+            parent.pop(path[-1], None)
+
+    return json.dumps(body, sort_keys=True, separators=(",", ":")).encode()
+
+
+@dataclass(slots=True)
+class IndexEntry:
+    size: int
+    access: float
+    expire: float
+
+
+@dataclass
+class CacheIndex:
+    """In-memory metadata of cached responses, ordered for fast eviction.
+
+    Heaps are never updated in place, outdated items are skipped when popped
+    and dropped when the heaps grow too large compared to the index.
+    """
+
+    entries: dict[str, IndexEntry] = field(default_factory=dict)
+    total_size: int = 0
+
+    _by_access: list[tuple[float, str]] = field(default_factory=list)
+    _by_expire: list[tuple[float, str]] = field(default_factory=list)
+
+    def set(self, key: str, size: int, access: float, expire: float) -> None:
+        self.discard(key)
+        self.entries[key] = IndexEntry(size, access, expire)
+        self.total_size += size
+        self._push(self._by_access, access, key)
+        self._push(self._by_expire, expire, key)
+
+    def touch(self, key: str, access: float) -> None:
+        if (entry := self.entries.get(key)):
+            entry.access = access
+            self._push(self._by_access, access, key)
+
+    def expire_at(self, key: str, expire: float) -> None:
+        if (entry := self.entries.get(key)):
+            entry.expire = expire
+            self._push(self._by_expire, expire, key)
+
+    def discard(self, key: str) -> None:
+        if (entry := self.entries.pop(key, None)):
+            self.total_size -= entry.size
+
+    def pop_expired(self, now: float) -> Iterator[str]:
+        while self._by_expire and self._by_expire[0][0] <= now:
+            expire, key = heapq.heappop(self._by_expire)
+            if (entry := self.entries.get(key)) and entry.expire == expire:
+                self.discard(key)
+                yield key
+
+    def pop_least_recent(self) -> str | None:
+        while self._by_access:
+            access, key = heapq.heappop(self._by_access)
+            if (entry := self.entries.get(key)) and entry.access == access:
+                self.discard(key)
+                return key
+        return None
+
+    def _push(
+        self, heap: list[tuple[float, str]], value: float, key: str,
+    ) -> None:
+        heapq.heappush(heap, (value, key))
+
+        if len(heap) > len(self.entries) * 2 + 1024:
+            attr = "access" if heap is self._by_access else "expire"
+            heap[:] = [
+                (getattr(entry, attr), key)
+                for key, entry in self.entries.items()
+            ]
+            heapq.heapify(heap)
+
+
+@dataclass
+class SQLiteDatabase:
+    """Database used by several threads, and server processes sharing `path`.
+
+    Subclasses create their tables with `schema`. Statements are run on
+    `_db` while holding `_lock`, which blocks on disk I/O: use these from
+    worker threads.
+    """
+
+    schema: ClassVar[str] = ""
+
+    path: Path
+
+    _db: sqlite3.Connection = field(init=False, repr=False)
+    _lock: threading.Lock = field(init=False, default_factory=threading.Lock)
+
+    def __post_init__(self) -> None:
+        self._db = sqlite3.connect(
+            self.path,
+            timeout = 30,
+            isolation_level = None,
+            check_same_thread = False,
+        )
+        # WAL lets other processes read while one writes
+        self._db.executescript(f"""
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            {self.schema}
+        """)
+
+
+@dataclass
+class ResponseCache(SQLiteDatabase):
+    """Compressed yt-dlp HTTP responses stored in a single SQLite table.
+
+    Access and expiration dates are separate columns, they can be updated
+    without reading or rewriting the compressed payload.
+    Triggers keep the total size in its own table. The index of these dates
+    is loaded once the cache first needs pruning, and reloaded at the start
+    of later rounds if other server processes changed the table.
+    """
+
+    schema: ClassVar[str] = """
+        -- Replaced rows count as deleted for the triggers
+        PRAGMA recursive_triggers = ON;
+        CREATE TABLE IF NOT EXISTS responses (
+            key TEXT PRIMARY KEY,
+            access REAL NOT NULL,
+            expire REAL NOT NULL,
+            size INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            headers TEXT NOT NULL,
+            status INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            codec TEXT NOT NULL,
+            data BLOB NOT NULL
+        );
+        BEGIN IMMEDIATE;
+        CREATE TABLE IF NOT EXISTS total_size (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            size INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO total_size
+            SELECT 0, IFNULL(SUM(size), 0) FROM responses;
+        CREATE TRIGGER IF NOT EXISTS responses_added
+            AFTER INSERT ON responses BEGIN
+                UPDATE total_size SET size = size + NEW.size;
+            END;
+        CREATE TRIGGER IF NOT EXISTS responses_removed
+            AFTER DELETE ON responses BEGIN
+                UPDATE total_size SET size = size - OLD.size;
+            END;
+        CREATE TRIGGER IF NOT EXISTS responses_resized
+            AFTER UPDATE OF size ON responses BEGIN
+                UPDATE total_size SET size = size - OLD.size + NEW.size;
+            END;
+        COMMIT;
+    """
+
+    _index: CacheIndex | None = field(init=False, default=None, repr=False)
+    _legacy_removed: bool = field(init=False, default=False)
+    _pruning: bool = field(init=False, default=False)
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        # Tables created before codecs were selectable only had lz4 data
+        columns = {
+            row[1] for row in self._db.execute("PRAGMA table_info(responses)")
+        }
+        if "codec" not in columns:
+            self._db.execute(
+                "ALTER TABLE responses "
+                "ADD COLUMN codec TEXT NOT NULL DEFAULT 'lz4'",
+            )
+
+    def response(self, key: str) -> CachedResponse | None:
+        now = datetime.now(UTC).timestamp()
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT url, headers, status, reason, codec, data, expire "
+                "FROM responses "
+                "WHERE key = ? AND expire > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute(
+                "UPDATE responses SET access = ? WHERE key = ?", (now, key),
+            )
+            if self._index:
+                self._index.touch(key, now)
+
+        url, headers, status, reason, codec, data, expire = row
+        try:
+            data = Codecs.get(codec).decompress(data)
+        except RuntimeError:
+            log.exception("Cached response %s is unreadable, removing", key)
+            self.remove((key,))
+            return None
+
+        return CachedResponse(
+            url, json.loads(headers), status, reason, data, expire,
+        )
+
+    def write(self, key: str, resp: CachedResponse) -> None:
+        now = datetime.now(UTC).timestamp()
+        codec = Codecs.default
+        zipped = codec.compress(resp.data)
+        headers = json.dumps(resp.headers)
+        size = len(zipped) + len(headers) + len(resp.url)
+
+        with self._lock:
+            self._db.execute(
+                # Columns named, migrated tables have codec last
+                "INSERT OR REPLACE INTO responses (key, access, expire, "
+                "size, url, headers, status, reason, codec, data) VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key, now, resp.expire, size, resp.url, headers,
+                    resp.status, resp.reason, codec.name, zipped,
+                ),
+            )
+            if self._index:
+                self._index.set(key, size, now, resp.expire)
+
+    def expire_in(self, keys: Iterable[str], seconds: float) -> None:
+        expire = datetime.now(UTC).timestamp() + seconds
+        keys = list(keys)
+
+        with self._lock:
+            self._db.executemany(
+                "UPDATE responses SET expire = ? WHERE key = ?",
+                [(expire, key) for key in keys],
+            )
+            for key in keys:
+                if self._index:
+                    self._index.expire_at(key, expire)
+
+    def track(self, keys: Iterable[str]) -> None:
+        """Index responses that were written by another process."""
+        with self._lock:
+            if self._index is None:
+                return
+            for key in keys:
+                if (row := self._db.execute(
+                    "SELECT size, access, expire FROM responses WHERE key = ?",
+                    (key,),
+                ).fetchone()):
+                    self._index.set(key, *row)
+
+    def remove(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            self._remove(keys)
+
+    def samples(self, limit: int = 2000) -> list[bytes]:
+        """Return decompressed bodies of random cached responses."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT codec, data FROM responses ORDER BY random() LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+        samples = []
+        for codec, data in rows:
+            with suppress(RuntimeError):
+                samples.append(Codecs.get(codec).decompress(data))
+        return samples
+
+    def prune(
+        self, high_watermark: int, low_watermark: int, max_evictions: int,
+    ) -> bool:
+        """Evict a bounded batch of responses, return whether more remain.
+
+        Eviction starts once the cache grows past `high_watermark` and
+        continues over successive calls until it shrinks below
+        `low_watermark`, expired responses first, then least recently used.
+        """
+        self._remove_legacy_files()
+        now = datetime.now(UTC).timestamp()
+
+        with self._lock:
+            total, index = self._total_size(), self._index
+        if not self._pruning and total <= high_watermark:
+            return False
+
+        if index is None or (not self._pruning and index.total_size != total):
+            # Not loaded yet or changed by other processes sharing the table,
+            # requests aren't held up during the scan
+            index = self._load_index()
+            with self._lock:
+                self._index = index
+
+        with self._lock:
+            evict = list(islice(index.pop_expired(now), max_evictions))
+            while len(evict) < max_evictions and \
+                    index.total_size > low_watermark:
+                if (key := index.pop_least_recent()) is None:
+                    break
+                evict.append(key)
+
+            self._remove(evict)
+            self._pruning = len(evict) == max_evictions
+            log.info(
+                "Pruned %d cached responses, %d bytes left",
+                len(evict), index.total_size,
+            )
+            return self._pruning
+
+    def _load_index(self) -> CacheIndex:
+        index = CacheIndex()
+        # Own connection, this one stays usable by other threads meanwhile
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            for row in db.execute(
+                "SELECT key, size, access, expire FROM responses",
+            ):
+                index.set(*row)
+        return index
+
+    def _total_size(self) -> int:
+        return self._db.execute("SELECT size FROM total_size").fetchone()[0]
+
+    def _remove(self, keys: Iterable[str]) -> None:
+        keys = list(keys)
+        self._db.executemany(
+            "DELETE FROM responses WHERE key = ?", [(k,) for k in keys],
+        )
+        for key in keys:
+            if self._index:
+                self._index.discard(key)
+
+    @staticmethod
+    def key(req: YtdlpRequest, normalize: bool = True) -> str | None:
+        """Hash a request, ignoring its volatile fields if `normalize`."""
+        if not isinstance(req.data, bytes | None):
+            return None
+
+        data = req.data or b""
+        if normalize:
+            data = normalize_body(req.url, data)
+
+        to_hash = (req.method + req.url).encode() + data
+        return hashlib.md5(to_hash, usedforsecurity=False).hexdigest()
+
+    def _remove_legacy_files(self) -> None:
+        # One file per response was used before the SQLite store
+        if self._legacy_removed:
+            return
+        for path in CACHE_DIR.iterdir():
+            if LEGACY_CACHE_FILE.fullmatch(path.name):
+                path.unlink(missing_ok=True)
+        self._legacy_removed = True
+
+
+RESPONSE_CACHE = ResponseCache(CACHE_DIR / "responses.sqlite3")
+CACHE_POLICY = CachePolicy.load(os.getenv("INSIDIOUS_CACHE_POLICY"))
+
+
+def train_zstd_dictionary() -> None:
+    samples = RESPONSE_CACHE.samples()
+    codec = ZstdCodec.train(samples, ZSTD_DICT_DIR)
+    print(f"Trained {codec.name} from {len(samples)} cached responses")
+
+
+def benchmark_codecs() -> None:
+    samples = RESPONSE_CACHE.samples()
+    print(f"{len(samples)} responses, {sum(map(len, samples))} bytes")
+    print(f"{'Codec':<20} {'Ratio':>8} {'Decoding MB/s':>14}")
+
+    for name, ratio, speed in benchmark([*Codecs.known.values()], samples):
+        print(f"{name:<20} {ratio:>8.2f} {speed:>14.0f}")
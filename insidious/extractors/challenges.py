@@ -0,0 +1,150 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import dataclasses
+import logging as log
+from collections.abc import Callable
+from dataclasses import dataclass
+from datetime import UTC, datetime
+from functools import wraps
+from typing import Any, ClassVar, TypeAlias
+
+from yt_dlp.extractor.youtube.jsc._director import (
+    JsChallengeRequestDirector,  # noqa: PLC2701
+)
+from yt_dlp.extractor.youtube.jsc.provider import (
+    JsChallengeRequest,
+    JsChallengeResponse,
+    JsChallengeType,
+    NChallengeOutput,
+    SigChallengeOutput,
+)
+
+from .cache import CACHE_DIR, SQLiteDatabase
+
+Solved: TypeAlias = list[tuple[JsChallengeRequest, JsChallengeResponse]]
+BulkSolve: TypeAlias = Callable[[Any, list[JsChallengeRequest]], Solved]
+
+MAX_AGE = 60 * 60 * 24 * 30
+OUTPUT_TYPES: dict[JsChallengeType, type[Any]] = {
+    JsChallengeType.N: NChallengeOutput,
+    JsChallengeType.SIG: SigChallengeOutput,
+}
+
+
+@dataclass
+class ChallengeCache(SQLiteDatabase):
+    """Player JS challenge solutions, shared by all YoutubeDL instances.
+
+    Solving requires running the player JS in an external runtime, but a
+    challenge always has the same solution for a given player version.
+    """
+
+    schema: ClassVar[str] = """
+        CREATE TABLE IF NOT EXISTS solutions (
+            player_url TEXT NOT NULL,
+            type TEXT NOT NULL,
+            challenge TEXT NOT NULL,
+            result TEXT NOT NULL,
+            solved REAL NOT NULL,
+            PRIMARY KEY (player_url, type, challenge)
+        );
+        CREATE INDEX IF NOT EXISTS solutions_solved ON solutions (solved);
+    """
+
+    hits: int = 0
+    misses: int = 0
+
+    def results(
+        self, player_url: str, type: JsChallengeType, challenges: list[str],
+    ) -> dict[str, str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT challenge, result FROM solutions "  # noqa: S608
+                "WHERE player_url = ? AND type = ? AND challenge IN "
+                f"({', '.join('?' * len(challenges))})",
+                (player_url, type.value, *challenges),
+            ).fetchall()
+        return dict(rows)
+
+    def store(
+        self,
+        player_url: str,
+        type: JsChallengeType,
+        results: dict[str, str],
+    ) -> None:
+        now = datetime.now(UTC).timestamp()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?, ?)",
+                [
+                    (player_url, type.value, challenge, result, now)
+                    for challenge, result in results.items()
+                ],
+            )
+
+    def prune(self, max_age: float = MAX_AGE) -> None:
+        # Players are replaced every few days, old solutions are useless
+        oldest = datetime.now(UTC).timestamp() - max_age
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM solutions WHERE solved < ?", (oldest,),
+            )
+        log.info(
+            "Player challenge solutions: %d cached, %d solved",
+            self.hits, self.misses,
+        )
+
+    def wrap(self, bulk_solve: BulkSolve) -> BulkSolve:
+        """Make a director's `bulk_solve` only solve unknown challenges."""
+
+        @wraps(bulk_solve)
+        def wrapper(
+            director: JsChallengeRequestDirector,
+            requests: list[JsChallengeRequest],
+        ) -> Solved:
+            solved: Solved = []
+            unknown: list[JsChallengeRequest] = []
+
+            for request in requests:
+                url, challenges = \
+                    request.input.player_url, request.input.challenges
+                known = self.results(url, request.type, challenges)
+                missing = [c for c in challenges if c not in known]
+                self.hits += len(known)
+                self.misses += len(missing)
+
+                if known:
+                    output = OUTPUT_TYPES[request.type](known)
+                    response = JsChallengeResponse(request.type, output)
+                    solved.append((request, response))
+                if missing:
+                    input = dataclasses.replace(
+                        request.input, challenges=missing,
+                    )
+                    unknown.append(dataclasses.replace(request, input=input))
+
+            if not unknown:
+                return solved
+
+            for request, response in bulk_solve(director, unknown):
+                url = request.input.player_url
+                self.store(url, request.type, response.output.results)
+                solved.append((request, response))
+            return solved
+
+        return wrapper
+
+
+CHALLENGE_CACHE = ChallengeCache(CACHE_DIR / "challenges.sqlite3")
+
+
+def share_challenge_solutions() -> None:
+    """Make all YoutubeDL instances use the persistent solution cache."""
+    director = JsChallengeRequestDirector
+    if not hasattr(director.bulk_solve, "__wrapped__"):
+        director.bulk_solve = CHALLENGE_CACHE.wrap(  # type: ignore
+            director.bulk_solve,
+        )
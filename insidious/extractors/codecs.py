@@ -0,0 +1,177 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, ClassVar
+
+import lz4.frame
+from typing_extensions import override
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator, Sequence
+    from pathlib import Path
+
+ZSTD_DICT_SIZE = 1024 * 112
+
+
+class CodecUnavailable(RuntimeError):
+    pass
+
+
+@dataclass
+class Codec:
+    """Compression method for cached responses, identified by its name."""
+
+    @property
+    def name(self) -> str:
+        raise NotImplementedError
+
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    def decompress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+
+@dataclass
+class LZ4Codec(Codec):
+    level: int = 3
+
+    @property
+    @override
+    def name(self) -> str:
+        return "lz4"
+
+    @override
+    def compress(self, data: bytes) -> bytes:
+        return lz4.frame.compress(data, compression_level=self.level)
+
+    @override
+    def decompress(self, data: bytes) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+@dataclass
+class ZstdCodec(Codec):
+    """Zstandard compression, optionally with a trained dictionary.
+
+    Cached pages and API responses are very similar to each other, a
+    dictionary trained on previous ones greatly improves compression ratio.
+    """
+
+    dictionary: bytes | None = None
+    level: int = 3
+
+    _dict_data: Any = field(init=False, default=None, repr=False)
+    # (De)compressor objects can't be shared between threads
+    _local: threading.local = \
+        field(init=False, default_factory=threading.local, repr=False)
+
+    def __post_init__(self) -> None:
+        if zstandard is None:
+            raise CodecUnavailable("zstandard module is not installed")
+        if self.dictionary:
+            self._dict_data = zstandard.ZstdCompressionDict(self.dictionary)
+            self._dict_data.precompute_compress(level=self.level)
+
+    @property
+    @override
+    def name(self) -> str:
+        if self._dict_data is None:
+            return "zstd"
+        return f"zstd-{self._dict_data.dict_id()}"
+
+    @override
+    def compress(self, data: bytes) -> bytes:
+        assert zstandard
+        if not hasattr(self._local, "compressor"):
+            self._local.compressor = zstandard.ZstdCompressor(
+                level=self.level, dict_data=self._dict_data,
+            )
+        return self._local.compressor.compress(data)
+
+    @override
+    def decompress(self, data: bytes) -> bytes:
+        assert zstandard
+        if not hasattr(self._local, "decompressor"):
+            self._local.decompressor = \
+                zstandard.ZstdDecompressor(dict_data=self._dict_data)
+        try:
+            return self._local.decompressor.decompress(data)
+        except zstandard.ZstdError as e:
+            raise RuntimeError(str(e)) from e  # like lz4 errors
+
+    @classmethod
+    def train(cls, samples: Sequence[bytes], dict_dir: Path) -> ZstdCodec:
+        if zstandard is None:
+            raise CodecUnavailable("zstandard module is not installed")
+
+        trained = zstandard.train_dictionary(ZSTD_DICT_SIZE, list(samples))
+        dict_dir.mkdir(parents=True, exist_ok=True)
+        path = dict_dir / f"{trained.dict_id()}.dict"
+        path.write_bytes(trained.as_bytes())
+        return cls(trained.as_bytes())
+
+    @classmethod
+    def from_dicts(cls, dict_dir: Path) -> list[ZstdCodec]:
+        """Codecs for all trained dictionaries, the most recent first."""
+        if zstandard is None or not dict_dir.exists():
+            return []
+
+        paths = sorted(
+            dict_dir.glob("*.dict"),
+            key = lambda p: p.stat().st_mtime,
+            reverse = True,
+        )
+        return [cls(path.read_bytes()) for path in paths]
+
+
+@dataclass
+class Codecs:
+    """Registry of known codecs, one of which compresses new data."""
+
+    known: ClassVar[dict[str, Codec]] = {}
+    default: ClassVar[Codec] = LZ4Codec()
+
+    @classmethod
+    def setup(cls, preferred: str, zstd_dict_dir: Path) -> None:
+        codecs: list[Codec] = [LZ4Codec()]
+        if zstandard is not None:
+            codecs += [*ZstdCodec.from_dicts(zstd_dict_dir), ZstdCodec()]
+
+        cls.known = {codec.name: codec for codec in codecs}
+        cls.default = next(
+            (c for c in codecs if c.name.startswith(preferred)), codecs[0],
+        )
+
+    @classmethod
+    def get(cls, name: str) -> Codec:
+        if name not in cls.known:
+            raise CodecUnavailable(f"Unknown or unavailable codec {name!r}")
+        return cls.known[name]
+
+
+def benchmark(
+    codecs: Sequence[Codec], samples: Sequence[bytes],
+) -> Iterator[tuple[str, float, float]]:
+    """Yield codec names, compression ratios and decoding speeds in MB/s."""
+    total = sum(map(len, samples))
+
+    for codec in codecs:
+        compressed = [codec.compress(sample) for sample in samples]
+        start = time.perf_counter()
+        for data in compressed:
+            codec.decompress(data)
+        elapsed = time.perf_counter() - start
+
+        ratio = total / max(1, sum(map(len, compressed)))
+        yield (codec.name, ratio, total / 1_000_000 / max(elapsed, 1e-9))
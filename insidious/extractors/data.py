@@ -4,6 +4,7 @@
 from __future__ import annotations
 
 import math
+import re
 from collections.abc import Iterator, Sequence
 from datetime import UTC, datetime
 from enum import auto
@@ -31,6 +32,7 @@ from typing_extensions import override
 from insidious.utils import AutoStrEnum
 
 T = TypeVar("T")
+STREAM_EXPIRE = re.compile(r"[/?&]expire[/=](\d+)")
 
 
 class LiveStatus(AutoStrEnum):
@@ -353,7 +355,7 @@ class Video(VideoEntry):
     aspect_ratio: float | None = None
     fps: float | None = None
     likes: int | None = Field(None, alias="like_count")
-    formats: list[Format]
+    formats: list[Format] = Field(default_factory=list)
     chapters: list[Chapter] | None = None
     subtitles: dict[str, list[Subtitle]] | None = None  # key = language code
     clip_start: float | None = Field(None, alias="section_start")
@@ -366,6 +368,16 @@ class Video(VideoEntry):
                 return "/proxy/get?url=%s" % quote(fmt.manifest_url)
         return f"/generate_hls/master?video_id={self.id}"
 
+    @property
+    def streams_expire(self) -> datetime | None:
+        """When the earliest googlevideo URL of this video stops working."""
+        dates = [
+            int(match[1]) for fmt in self.formats
+            for url in (fmt.url, fmt.manifest_url or "")
+            if (match := STREAM_EXPIRE.search(url))
+        ]
+        return datetime.fromtimestamp(min(dates), UTC) if dates else None
+
     @property
     def storyboard_url(self) -> str:
         return f"/storyboard?video_id={self.id}"
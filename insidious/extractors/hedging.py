@@ -0,0 +1,109 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import asyncio
+import logging as log
+import os
+import statistics
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, ClassVar
+
+from .invidious import INVIDIOUS, InvidiousClient
+from .ytdlp import YTDLP, YtdlpClient
+
+if TYPE_CHECKING:
+    from collections import deque
+    from collections.abc import Collection
+
+    from .data import Video
+
+HEDGE = bool(os.getenv("INSIDIOUS_HEDGE"))
+
+
+@dataclass
+class LatencyTracker:
+    """Durations of recent operations, to tell when one is unusually slow."""
+
+    samples: deque[float]
+    percentile: int = 95
+    min_samples: int = 32
+    default: float = 5  # seconds, until there are enough samples
+    floor: float = 0.5
+
+    @property
+    def threshold(self) -> float:
+        if len(self.samples) < self.min_samples:
+            return self.default
+        cuts = statistics.quantiles(self.samples, n=100)
+        return max(self.floor, cuts[self.percentile - 1])
+
+
+@dataclass
+class HedgedClient:
+    """Ask Invidious for video details when yt-dlp is unusually slow.
+
+    The Invidious request only starts once yt-dlp took longer than most of
+    its recent extractions, and the first answer wins. A losing yt-dlp
+    extraction keeps going, to have the video cached for later requests.
+    """
+
+    primary: YtdlpClient
+    backup: InvidiousClient
+    enabled: bool = HEDGE
+    # Only actual extractions, answers from caches would skew the threshold
+    latency: LatencyTracker = field(
+        default_factory=lambda: LatencyTracker(YtdlpClient.metadata_times),
+    )
+
+    _background: ClassVar[set[asyncio.Task[Video]]] = set()
+
+    async def video(
+        self, id: str, fields: Collection[str] | None = None,
+    ) -> Video:
+        # See YtdlpClient.video for `fields`, only requests for those that
+        # Invidious provides as well are hedged
+        if not self.enabled or fields is None or \
+                not self.backup.video_fields.issuperset(fields):
+            return await self.primary.video(id, fields=fields)
+
+        primary = asyncio.create_task(self.primary.video(id, fields=fields))
+        backup: asyncio.Task[Video] | None = None
+        try:
+            delay = self.latency.threshold
+            if (await asyncio.wait({primary}, timeout=delay))[0]:
+                return primary.result()
+
+            log.info("yt-dlp slower than %.1fs for %s, hedging", delay, id)
+            backup = asyncio.create_task(self.backup.video(id))
+            return await self._first_success(primary, backup)
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+        finally:
+            if backup:
+                backup.cancel()
+            if not primary.done():
+                self._background.add(primary)
+                primary.add_done_callback(self._background.discard)
+
+    @staticmethod
+    async def _first_success(
+        primary: asyncio.Task[Video], backup: asyncio.Task[Video],
+    ) -> Video:
+        pending = {primary, backup}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                if task is backup:
+                    log.warning("Invidious failed: %r", task.exception())
+
+        return primary.result()  # raise yt-dlp's error, the more relevant
+
+
+HEDGED = HedgedClient(YTDLP, INVIDIOUS)
@@ -3,20 +3,179 @@
 
 import json
 import logging
+import re
 from dataclasses import dataclass
+from datetime import UTC, datetime
+from typing import Any, ClassVar
+from urllib.parse import quote_plus
 
 import backoff
 import httpx
+from fastapi.datastructures import URL
 from typing_extensions import override
 
 from insidious.net import HTTPX_BACKOFF_ERRORS
 
 from .client import APIClient, APIInstance
-from .data import Comments
+from .data import Comments, Playlist, Search, Video
+from .filters import Date, Duration, Features, SearchFilter, Sort, Type
+
+RawData = dict[str, Any]
+
+YOUTUBE = "https://www.youtube.com"
+CODECS = re.compile(r'codecs="([^"]+)"')
+SORTS = {
+    Sort.Relevance: "relevance",
+    Sort.Rating: "rating",
+    Sort.Date: "upload_date",
+    Sort.Views: "view_count",
+}
+DATES = {
+    Date.LastHour: "hour",
+    Date.Today: "today",
+    Date.ThisWeek: "week",
+    Date.ThisMonth: "month",
+    Date.ThisYear: "year",
+}
+TYPES = {
+    Type.Video: "video",
+    Type.Channel: "channel",
+    Type.Playlist: "playlist",
+    Type.Movie: "movie",
+}
+DURATIONS = {
+    Duration.Under4Min: "short",
+    Duration.Over20Min: "long",
+    Duration.From4To20Min: "medium",
+}
+FEATURES = {
+    Features.Live: "live",
+    Features.In4K: "4k",
+    Features.HD: "hd",
+    Features.Subtitles: "subtitles",
+    Features.CreativeCommons: "creative_commons",
+    Features.In360: "360",
+    Features.VR180: "vr180",
+    Features.In3D: "3d",
+    Features.HDR: "hdr",
+    Features.Location: "location",
+    Features.Purchased: "purchased",
+}
+
+
+def _not_found(e: Exception) -> bool:
+    return isinstance(e, httpx.HTTPStatusError) and \
+        e.response.status_code == 404  # noqa: PLR2004
 
 
 @dataclass
 class InvidiousClient(APIClient):
+    # Video attributes that are as complete as when extracted by yt-dlp
+    video_fields: ClassVar[frozenset[str]] = frozenset({
+        "title", "description", "duration", "views", "likes",
+        "upload_date", "thumbnails", "channel_id", "channel_name",
+        "channel_url", "live_status", "live_release_date", "subtitles",
+        "webvtt_storyboard",
+    })
+
+    @override
+    async def search(
+        self, query: str, filter: SearchFilter | None = None, page: int = 1,
+    ) -> Search:
+
+        filter = filter or SearchFilter()
+        params = {"q": query, "page": page, "sort": SORTS[filter.sort]}
+        if filter.date:
+            params["date"] = DATES[filter.date]
+        if filter.type:
+            params["type"] = TYPES[filter.type]
+        if filter.duration:
+            params["duration"] = DURATIONS[filter.duration]
+        if filter.features:
+            params["features"] = ",".join(
+                name for feat, name in FEATURES.items()
+                if filter.features & feat
+            )
+
+        api, items = await self._get("/search", params)
+        return Search.model_validate({
+            "original_url": f"{YOUTUBE}/results?search_query=" +
+                quote_plus(query),
+            "title": query,
+            "entries": [
+                entry for item in items
+                if (entry := self._entry_data(api, item))
+            ],
+        })
+
+    @override
+    async def playlist(self, id: str, page: int = 1) -> Playlist:
+        api, data = await self._get(f"/playlists/{id}", {"page": page})
+        updated = data.get("updated")
+
+        pl = Playlist.model_validate({
+            "id": data["playlistId"],
+            "original_url": f"{YOUTUBE}/playlist?list={id}",
+            "title": data["title"],
+            "description": data.get("description"),
+            "view_count": data.get("viewCount"),
+            "playlist_count": data.get("videoCount"),
+            "modified_date": updated and datetime.fromtimestamp(updated, UTC)
+                .strftime("%Y%m%d"),
+            "channel": data.get("author"),
+            "channel_id": data.get("authorId"),
+            "channel_url": self._channel_url(data),
+            "thumbnails": [{"url": url}]
+                if (url := data.get("playlistThumbnail")) else [],
+            "entries": [
+                self._video_entry_data(api, v) | {"nth": v["index"] + 1}
+                for v in data.get("videos", [])
+            ],
+        })
+        # Like yt-dlp's playlist entries
+        for entry in pl:
+            url = URL(entry.url).include_query_params(list=pl.id)
+            if entry.nth not in {None, 1}:
+                url = url.include_query_params(index=entry.nth)
+            entry.url = str(url)
+        return pl
+
+    @override
+    async def video(self, id: str) -> Video:
+        api, data = await self._get(f"/videos/{id}")
+        formats = [
+            self._format_data(api, f) for f in
+            (*data.get("formatStreams", []), *data.get("adaptiveFormats", []))
+            if f.get("url")
+        ]
+        formats += [
+            self._storyboard_data(api, i, sb)
+            for i, sb in enumerate(data.get("storyboards", []))
+            if sb.get("templateUrl") and sb.get("count")
+        ]
+        if (hls := data.get("hlsUrl")):
+            hls = self._absolute(api, hls)
+            formats.append({
+                "format_id": "hls",
+                "protocol": "m3u8_native",
+                "url": hls,
+                "manifest_url": hls,
+            })
+
+        return Video.model_validate(self._video_entry_data(api, data) | {
+            "entry_type": "Video",
+            "original_url": f"{YOUTUBE}/watch?v={id}",
+            "like_count": data.get("likeCount"),
+            "formats": formats,
+            "subtitles": {
+                c["languageCode"]: [{
+                    "ext": "vtt",
+                    "url": self._absolute(api, c["url"]),
+                    "name": c.get("label"),
+                }] for c in data.get("captions", [])
+            },
+        })
+
     @override
     @backoff.on_exception(
         backoff.constant,
@@ -62,6 +221,169 @@ class InvidiousClient(APIClient):
 
         return comments
 
+    @backoff.on_exception(
+        backoff.constant,
+        (OSError, json.JSONDecodeError, *HTTPX_BACKOFF_ERRORS),
+        max_tries = 20,
+        interval = 0,
+        giveup = _not_found,
+        backoff_log_level = logging.WARNING,
+    )
+    async def _get(
+        self, path: str, params: dict[str, Any] | None = None,
+    ) -> tuple[APIInstance, Any]:
+
+        api = await self._api()
+        try:
+            reply = await self._httpx.get(api.url + path, params=params)
+            reply.raise_for_status()
+            return (api, reply.json())
+        except Exception as e:
+            if not _not_found(e):
+                api.fail()
+            raise
+
+    @staticmethod
+    def _absolute(api: APIInstance, url: str | None) -> str | None:
+        # Instances give relative URLs for what they proxy or serve
+        if not url or not url.startswith("/") or url.startswith("//"):
+            return url
+        return api.url.removesuffix("/api/v1") + url
+
+    @staticmethod
+    def _channel_url(item: RawData) -> str | None:
+        return f"{YOUTUBE}/channel/{id}" if (id := item.get("authorId")) \
+            else None
+
+    @classmethod
+    def _entry_data(cls, api: APIInstance, item: RawData) -> RawData | None:
+        if item["type"] == "video":
+            return cls._video_entry_data(api, item)
+
+        if item["type"] == "channel":
+            url = f"{YOUTUBE}/channel/{item['authorId']}"
+            return {
+                "entry_type": "ChannelEntry",
+                "id": item["authorId"],
+                "url": url,
+                "title": item["author"],
+                "uploader": item["author"],
+                "channel_id": item["authorId"],
+                "channel_url": url,
+                "channel_follower_count": item.get("subCount"),
+                "thumbnails": cls._thumbnails(
+                    api, item.get("authorThumbnails", []),
+                ),
+            }
+
+        if item["type"] == "playlist":
+            thumb = item.get("playlistThumbnail")
+            return {
+                "entry_type": "PlaylistEntry",
+                "id": item["playlistId"],
+                "url": f"{YOUTUBE}/playlist?list={item['playlistId']}",
+                "title": item["title"],
+                "thumbnails": cls._thumbnails(api, [{"url": thumb}])
+                    if thumb else [],
+            }
+
+        return None  # e.g. hashtags and categories
+
+    @classmethod
+    def _video_entry_data(cls, api: APIInstance, item: RawData) -> RawData:
+        status = None
+        if item.get("isUpcoming"):
+            status = "is_upcoming"
+        elif item.get("liveNow"):
+            status = "is_live"
+
+        return {
+            "entry_type": "VideoEntry",
+            "id": item["videoId"],
+            "url": f"{YOUTUBE}/watch?v={item['videoId']}",
+            "title": item["title"],
+            "description": item.get("description"),
+            "duration": item.get("lengthSeconds"),
+            "view_count": item.get("viewCount"),
+            "timestamp": item.get("published"),
+            "live_status": status,
+            "release_timestamp": item.get("premiereTimestamp") or None,
+            "channel": item.get("author"),
+            "channel_id": item.get("authorId"),
+            "channel_url": cls._channel_url(item),
+            "thumbnails": cls._thumbnails(
+                api, item.get("videoThumbnails", []),
+            ),
+        }
+
+    @classmethod
+    def _thumbnails(
+        cls, api: APIInstance, thumbnails: list[RawData],
+    ) -> list[RawData]:
+        return [{
+            "url": cls._absolute(api, t["url"]),
+            "width": t.get("width"),
+            "height": t.get("height"),
+        } for t in thumbnails]
+
+    @classmethod
+    def _format_data(cls, api: APIInstance, fmt: RawData) -> RawData:
+        kind = fmt.get("type", "").partition("/")[0]
+        codecs = next(iter(CODECS.findall(fmt.get("type", ""))), "")
+        codecs = [c.strip() for c in codecs.split(",") if c.strip()]
+        width, _, height = (fmt.get("size") or "").partition("x")
+
+        if kind == "audio":
+            vcodec, acodec = "none", next(iter(codecs), None)
+        elif len(codecs) > 1:
+            vcodec, acodec = codecs[0], codecs[1]
+        else:
+            vcodec, acodec = next(iter(codecs), None), "none"
+
+        return {
+            "format_id": str(fmt["itag"]),
+            "format_note": fmt.get("qualityLabel") or fmt.get("quality"),
+            "protocol": "https",
+            "url": cls._absolute(api, fmt["url"]),
+            "container": fmt.get("container"),
+            "vcodec": vcodec,
+            "acodec": acodec,
+            "tbr": int(fmt["bitrate"]) / 1000 if fmt.get("bitrate") else None,
+            "filesize": int(fmt["clen"]) if fmt.get("clen") else None,
+            "width": int(width) if width.isdigit() else None,
+            "height": int(height) if height.isdigit() else None,
+            "fps": fmt.get("fps"),
+            "audio_channels": fmt.get("audioChannels"),
+        }
+
+    @classmethod
+    def _storyboard_data(
+        cls, api: APIInstance, index: int, board: RawData,
+    ) -> RawData:
+        # Same shape as yt-dlp's storyboard formats, one fragment per sheet
+        url = cls._absolute(api, board["templateUrl"]) or ""
+        columns = board.get("storyboardWidth") or 1
+        rows = board.get("storyboardHeight") or 1
+        per_sheet = columns * rows
+        interval = (board.get("interval") or 0) / 1000
+        sheets = -(-board["count"] // per_sheet)
+
+        return {
+            "format_id": f"sb{index}",
+            "format_note": "storyboard",
+            "protocol": "mhtml",
+            "url": url,
+            "width": board.get("width"),
+            "height": board.get("height"),
+            "columns": columns,
+            "rows": rows,
+            "fragments": [{
+                "url": url.replace("$M", str(n)),
+                "duration":
+                    min(per_sheet, board["count"] - n * per_sheet) * interval,
+            } for n in range(sheets)],
+        }
+
     @override
     @classmethod
     @backoff.on_exception(
@@ -4,45 +4,63 @@
 from __future__ import annotations
 
 import asyncio
-import hashlib
-import io
-import json
+import copy
 import logging as log
+import math
+import multiprocessing
+import os
+import re
 import threading
+import time
 import urllib.request
-from collections import defaultdict
-from collections.abc import Callable, Iterable, Iterator
-from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, deque
+from collections.abc import Callable, Collection, Coroutine, Iterator
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
 from contextlib import contextmanager, suppress
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from datetime import UTC, datetime
-from operator import itemgetter
-from pathlib import Path
+from functools import partial
+from itertools import chain
 from typing import (
     Any,
     ClassVar,
     Self,
     TypeAlias,
     TypeVar,
+    cast,
 )
 from urllib.parse import parse_qs, quote_plus
 
-import appdirs
 import backoff
-import lz4.frame
 import yt_dlp
 from fastapi.datastructures import URL
+from pydantic import BaseModel
 from typing_extensions import override
 from yt_dlp import YoutubeDL
 from yt_dlp.networking.common import (
     Request as YtdlpRequest,
     Response as YtdlpResponse,
 )
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils.networking import HTTPHeaderDict, std_headers
 
-from insidious import NAME
 from insidious.extractors.filters import SearchFilter
 from insidious.net import PARALLEL_REQUESTS_PER_HOST, max_parallel_requests
-
+from insidious.utils import report
+
+from .cache import (
+    CACHE_DIR,
+    CACHE_POLICY,
+    RESPONSE_CACHE,
+    CachedResponse,
+    MemoryCache,
+)
+from .challenges import CHALLENGE_CACHE, share_challenge_solutions
 from .client import YoutubeClient
 from .data import (
     Channel,
@@ -62,124 +80,161 @@ from .data import (
 )
 
 T = TypeVar("T")
+M = TypeVar("M", bound=BaseModel)
 RawData: TypeAlias = dict[str, Any]
 RequestCallback: TypeAlias = Callable[[YtdlpRequest], None]
 
-MAX_CACHE_TIME = 60 * 60
-CACHE_DIR = Path(appdirs.user_cache_dir(NAME))
-CACHE_DIR.mkdir(parents=True, exist_ok=True)
+MEMORY_CACHE_SIZE = 1024 * 1024 * 64
+MODEL_CACHE_ENTRIES = 512
+WRITER_KEYS_ENTRIES = 8192
+MAX_STALE_TIME = 60 * 60 * 3
+STREAM_REFRESH_MARGIN = 60 * 60
+STREAM_MIN_LIFETIME = 60 * 10
+OLD_PLAYLIST_AGE = 60 * 60 * 24 * 30
+CURSOR_ENTRIES = 256
+CURSOR_LIFETIME = 60 * 30
+CACHE_HIGH_WATERMARK = 1024 * 1024 * 512
+CACHE_LOW_WATERMARK = CACHE_HIGH_WATERMARK * 2 // 3
+PRUNE_BATCH_SIZE = 256
+EXTRACT_PROCESSES = int(os.getenv("INSIDIOUS_EXTRACT_PROCESSES") or 0)
+EXTRACT_TIMEOUT = float(os.getenv("INSIDIOUS_EXTRACT_TIMEOUT") or 120)
+UNAVAILABLE_ENTRIES = 4096
+CHANNEL_TAB_ENTRIES = 4096
+# Tabs tried for channels by default, the first that works is shown
+CHANNEL_PROBE_TABS = ("featured", "videos", "playlists", "streams", "shorts")
+CHANNEL_PROBES = 3  # in parallel per channel
+UNAVAILABLE_TTL = 60 * 5
+# Extractor errors for content that's gone for good, unless also transient
+UNAVAILABLE_REASONS = re.compile(
+    r"video unavailable|private video|video is private|has been removed|"
+    r"(does not|doesn't) exist|not a valid URL|unsupported URL|"
+    r"account .*terminated",
+    re.IGNORECASE,
+)
+TRANSIENT_REASONS = re.compile(
+    r"try again later|not a bot|sign in to confirm|too many requests|"
+    r"rate.?limit",
+    re.IGNORECASE,
+)
+YTDL_PARAMS: dict[str, Any] = {
+    "quiet": True,
+    # Parsed players and signature functions, shared by all instances
+    "cachedir": str(CACHE_DIR / "yt-dlp"),
+    "extract_flat": "in_playlist",
+    "ignore_no_formats_error": True,  # Don't fail on premiering vids
+    "compat_opts": ["no-youtube-unavailable-videos"],
+    "extractor_args": {
+        # This client has the HLS manifests, no need for others
+        "youtube": {"player_client": ["android_vr"]},
+        # Retrieve upload dates in flat playlists
+        "youtubetab": {"approximate_date": ["timestamp"]},
+    },
+}
+# Don't resolve playable formats: no player JS, challenges or manifests
+METADATA_YTDL_PARAMS: dict[str, Any] = YTDL_PARAMS | {
+    "extractor_args": YTDL_PARAMS["extractor_args"] | {
+        "youtube": {
+            "player_client": ["android_vr"],
+            "player_skip": ["js", "configs"],
+            "skip": ["hls", "dash", "translated_subs"],
+        },
+    },
+}
+# Video attributes that need playable formats
+FORMAT_FIELDS = frozenset({"formats", "manifest_url", "streams_expire"})
 ExpireIn: TypeAlias = Callable[[float], None]
+ModelKey: TypeAlias = tuple[str, str, int]  # client method, URL path, page
+# URL path, page, process, skip cache, metadata only
+ExtractKey: TypeAlias = tuple[str, int, bool, bool, bool]
+
+
+share_challenge_solutions()
 
 
 class NoDataReceived(yt_dlp.utils.ExtractorError):
     def __init__(self) -> None:
         super().__init__("Failed to gather any data from origin site")
 
+    @override
+    def __reduce__(self) -> tuple[type[Self], tuple[()]]:
+        return (type(self), ())  # can be sent back from worker processes
+
 
-@dataclass
-class CacheFile:
-    path: Path
-
-    _locks: ClassVar[defaultdict[Path, threading.Lock]] = \
-        defaultdict(threading.Lock)
-
-    class _CompatibleBytesIO(io.BytesIO):
-        @override
-        def read(self, *_: Any, **__: Any) -> bytes:
-            return super().read()
-
-    def dates(self) -> tuple[datetime, datetime]:
-        with self._lock:
-            raw = self.path.read_bytes()
-
-        access, expire = self._unzip(raw).splitlines()[:2]
-        access_date = datetime.fromtimestamp(float(access))
-        expire_date = datetime.fromtimestamp(float(expire))
-        return access_date, expire_date
-
-    def expire_in(self, seconds: float) -> None:
-        with self._lock, self.path.open("rb+") as f:
-            access, _, *rest = self._unzip(f.read()).splitlines()
-            expire = str(datetime.now(UTC).timestamp() + seconds).encode()
-            lines = [access, expire, *rest]
-            f.seek(0)
-            f.write(self._zip(b"\n".join(lines)))
-
-    def response(self) -> YtdlpResponse | None:
-        if not self.path.exists():
-            return None
-
-        with self._lock, self.path.open("rb+") as f:
-            try:
-                dump = self._unzip(f.read())
-            except RuntimeError:
-                log.exception("%s is corrupted, removing", self.path)
-                self.path.unlink()
-                return None
-
-            _, *lines = dump.splitlines()
-            expire_ts, url, headers, status, reason, *data = lines
-
-            expire_date = datetime.fromtimestamp(float(expire_ts), UTC)
-            if datetime.now(UTC) >= expire_date:
-                return None
-
-            access_ts = str(datetime.now(UTC).timestamp()).encode()
-            f.seek(0)
-            f.write(self._zip(b"\n".join((access_ts, *lines))))
-
-        return YtdlpResponse(
-            io.BytesIO(b"\n".join(data)),
-            url.decode(),
-            json.loads(headers),
-            int(status),
-            reason.decode(),
-        )
+class InstanceRetired(RuntimeError):
+    """A pooled YoutubeDL was replaced while it wasn't checked out."""
 
-    def write(self, resp: YtdlpResponse, cache_time: float) -> None:
-        now = datetime.now(UTC).timestamp()
-        dump = "\n".join((
-            str(now),
-            str(now + cache_time),
-            resp.url,
-            json.dumps(dict(resp.headers)),
-            str(resp.status),
-            resp.reason or "",
-            "",
-        )).encode() + (data := resp.read())
-        resp.fp = self._CompatibleBytesIO(data)
-        with self._lock:
-            self.path.write_bytes(self._zip(dump))
 
-    @classmethod
-    def from_request(cls, req: YtdlpRequest) -> Self | None:
-        if not isinstance(req.data, bytes | None):
-            return None
+class ContentUnavailable(yt_dlp.DownloadError):
+    """Extraction failed because what was requested doesn't exist."""
 
-        to_hash = (req.method + req.url).encode() + (req.data or b"")
-        md5 = hashlib.md5(to_hash, usedforsecurity=False).hexdigest()
-        return cls(CACHE_DIR / md5)
 
-    @property
-    def _lock(self) -> threading.Lock:
-        return self._locks[self.path]
+class ExtractionCancelled(yt_dlp.utils.DownloadCancelled):
+    msg = "Extraction was abandoned or took too long"
+
 
-    @staticmethod
-    def _zip(data: bytes) -> bytes:
-        return lz4.frame.compress(data, compression_level=3)
+@dataclass(slots=True)
+class Deadline:
+    """Time after which nobody waits for an extraction's result anymore."""
 
-    @staticmethod
-    def _unzip(data: bytes) -> bytes:
-        return lz4.frame.decompress(data)
+    at: float = math.inf
+    cancelled: threading.Event = field(default_factory=threading.Event)
+    started: float = field(default_factory=time.time)
+
+    def remaining(self) -> float:
+        return max(0, self.at - time.time())
+
+    def extend(self, seconds: float) -> None:
+        self.at = time.time() + seconds
+
+    def check(self) -> None:
+        if self.cancelled.is_set() or time.time() >= self.at:
+            raise ExtractionCancelled
+
+
+@dataclass(slots=True)
+class EntriesCursor:
+    """Paused iteration of an extraction's entries, at the start of a page."""
+
+    ytdl: CachedYoutubeDL
+    data: RawData
+    entries: Iterator[RawData]
+    nth: int
+    first: RawData | None  # already received, None if no more entries
+
+
+@dataclass(slots=True)
+class CachedModel:
+    model: BaseModel
+    fresh_until: float
+
+
+class _Hooks(threading.local):
+    urlopen_callback: RequestCallback | None = None
+    deadline: Deadline | None = None
+    newly_written: list[str] | None = None
+    all_written: list[str] | None = None
+    skip_cache: bool = False
 
 
 class CachedYoutubeDL(YoutubeDL):
-    # WARN: not threadsafe
+    # WARN: not threadsafe, only use instances checked out from a pool
+
+    # Shared by all instances, in front of the disk cache
+    memory_cache: ClassVar[MemoryCache[str, CachedResponse]] = \
+        MemoryCache(MEMORY_CACHE_SIZE)
+    # Unnormalized keys of the requests that wrote recent responses
+    writer_keys: ClassVar[MemoryCache[str, str]] = \
+        MemoryCache(WRITER_KEYS_ENTRIES)
+    cache_hits: ClassVar[int] = 0
+    normalized_hits: ClassVar[int] = 0
+
     def __init__(self, *args: Any, **kwargs: Any) -> None:
         super().__init__(*args, **kwargs)
-        self._newly_written: list[CacheFile] | None = None
-        self._urlopen_callback: RequestCallback | None = None
-        self._skip_cache: bool = False
+        # Paused extractions can be resumed from any thread
+        self._hooks = _Hooks()
+        self.uses = 0
+        self.created = time.monotonic()
+        self.retired = False
 
     @override
     def urlopen(
@@ -191,91 +246,344 @@ class CachedYoutubeDL(YoutubeDL):
         elif isinstance(req, urllib.request.Request):
             req = yt_dlp.compat.urllib_req_to_req(req)
 
-        if self._urlopen_callback:
-            self._urlopen_callback(req)
+        # Stop abandoned extractions before their next request
+        if self._hooks.deadline:
+            self._hooks.deadline.check()
 
-        if (file := CacheFile.from_request(req)):
-            if not self._skip_cache and (resp := file.response()):
+        if self._hooks.urlopen_callback:
+            self._hooks.urlopen_callback(req)
+
+        if (key := RESPONSE_CACHE.key(req)):
+            raw_key = RESPONSE_CACHE.key(req, normalize=False) or key
+            if not self._hooks.skip_cache and (cached := self._cached(key)):
+                self._count_hit(key, raw_key)
+                return cached.to_ytdlp()
+
+            resp = super().urlopen(req)
+            ttl = CACHE_POLICY.rule_ttl(req.url, dict(resp.headers))
+            if ttl is not None and ttl <= 0:
                 return resp
 
-            file.write(resp := super().urlopen(req), MAX_CACHE_TIME)
-            if self._newly_written is not None:
-                self._newly_written.append(file)
+            cached = CachedResponse.from_ytdlp(
+                resp, ttl or CACHE_POLICY.default,
+            )
+            RESPONSE_CACHE.write(key, cached)
+            self.memory_cache.put(key, cached, cached.size, cached.expire)
+            self.writer_keys.put(key, raw_key)
+            if self._hooks.all_written is not None:
+                self._hooks.all_written.append(key)
+            # URL rules take precedence over the extraction's cache time
+            if ttl is None and self._hooks.newly_written is not None:
+                self._hooks.newly_written.append(key)
             return resp
 
         return super().urlopen(req)
 
     @contextmanager
     def before_requests(self, callback: RequestCallback) -> Iterator[None]:
-        self._urlopen_callback = callback
+        self._hooks.urlopen_callback = callback
         try:
             yield
         finally:
-            self._urlopen_callback = None
+            self._hooks.urlopen_callback = None
 
     @contextmanager
     def adjust_cache_expiration(self) -> Iterator[ExpireIn]:
-        self._newly_written = batch = []
+        self._hooks.newly_written = batch = []
 
         def make_expire_in(seconds: float):
-            for file in batch:
-                file.expire_in(seconds)
+            RESPONSE_CACHE.expire_in(batch, seconds)
+            expire = datetime.now(UTC).timestamp() + seconds
+            for key in batch:
+                self.memory_cache.expire_at(key, expire)
 
         try:
             yield make_expire_in
         finally:
-            self._newly_written = None
+            self._hooks.newly_written = None
+
+    @contextmanager
+    def record_writes(self) -> Iterator[tuple[list[str], list[str]]]:
+        # Keys of all newly cached responses, and of those with adjustable
+        # expiration, for extractions done in another process
+        self._hooks.all_written = written = []
+        self._hooks.newly_written = expirable = []
+        try:
+            yield (written, expirable)
+        finally:
+            self._hooks.all_written = self._hooks.newly_written = None
+
+    @contextmanager
+    def until(self, deadline: Deadline) -> Iterator[None]:
+        self._hooks.deadline = deadline
+        try:
+            yield
+        finally:
+            self._hooks.deadline = None
 
     @contextmanager
     def skip_cache(self, skip: bool = True) -> Iterator[None]:
-        self._skip_cache = skip
+        self._hooks.skip_cache = skip
         try:
             yield
         finally:
-            self._skip_cache = False
+            self._hooks.skip_cache = False
+
+    @classmethod
+    def prune_cache(cls) -> bool:
+        """Run one bounded pruning step, return whether more work remains."""
+        more = RESPONSE_CACHE.prune(
+            CACHE_HIGH_WATERMARK, CACHE_LOW_WATERMARK, PRUNE_BATCH_SIZE,
+        )
+        if not more:
+            CHALLENGE_CACHE.prune()
+            mem = cls.memory_cache
+            log.info(
+                "Memory cache: %d responses, %d bytes, %d hits, %d misses",
+                len(mem), mem.size, mem.hits, mem.misses,
+            )
+            log.info(
+                "Response cache: %d hits, %d only due to key normalization",
+                cls.cache_hits, cls.normalized_hits,
+            )
+        return more
+
+    @classmethod
+    def _count_hit(cls, key: str, raw_key: str) -> None:
+        # Only known while the response's writer is remembered, an estimate
+        cls.cache_hits += 1
+        writer = cls.writer_keys.get(key)
+        if writer is not None and writer != raw_key:
+            cls.normalized_hits += 1
+
+    def _cached(self, key: str) -> CachedResponse | None:
+        if (cached := self.memory_cache.get(key)):
+            return cached
+        if (cached := RESPONSE_CACHE.response(key)):
+            self.memory_cache.put(key, cached, cached.size, cached.expire)
+        return cached
+
+
+def is_unavailable(error: Exception) -> bool:
+    """Whether an error means retrying later would give the same result."""
+    if isinstance(error, (ContentUnavailable, ChannelNotFound)):
+        return True
+    if not isinstance(error, yt_dlp.DownloadError) or not error.exc_info:
+        return False
+
+    cause = error.exc_info[1]
+    if not isinstance(cause, yt_dlp.utils.ExtractorError):
+        return False
+    if isinstance(cause.cause, HTTPError):
+        return cause.cause.status in {404, 410}
+    # Not cause.expected, which also marks bot checks and rate limiting
+    reason = str(cause)
+    return bool(UNAVAILABLE_REASONS.search(reason)) and \
+        not TRANSIENT_REASONS.search(reason)
+
+
+def _entry_type(entry: RawData, in_featured: bool) -> type[BaseModel]:
+    url = entry["url"]
+    if "/shorts/" in url:
+        return ShortEntry
+    if url.endswith("/posts"):
+        return FeaturedChannelPosts
+    if "/channel/" in url:
+        return ChannelEntry
+    if "/playlist?" in url:
+        return FeaturedChannelPlaylist if in_featured else PlaylistEntry
+    if any(f"/{name}?" in url for name in Channel.tabs):
+        return FeaturedChannelTab
+    if "concurrent_view_count" in entry:
+        return PartialEntry
+    return VideoEntry
+
+
+def _settle(future: asyncio.Future[T], value: T) -> None:
+    if not future.done():  # else the awaiting caller was cancelled
+        future.set_result(value)
+
+
+def _fail(future: asyncio.Future[Any], exception: Exception) -> None:
+    if not future.done():
+        future.set_exception(exception)
+
+
+_worker = threading.local()
+
+
+def extract_in_worker(
+    url: str, skip_cache: bool = False, deadline: float = math.inf,
+) -> tuple[RawData, list[str], list[str]]:
+    # Return picklable data, keys of all newly cached responses and of those
+    # whose expiration can be adjusted
+    ytdl = worker_ytdl()
+    limit = Deadline(deadline)
+
+    @backoff.on_exception(
+        backoff.expo, NoDataReceived, max_tries=10, max_time=limit.remaining,
+    )
+    def attempt() -> RawData:
+        limit.check()
+        with ytdl.until(limit), ytdl.skip_cache(skip_cache):
+            data = ytdl.extract_info(url, process=True, download=False)
+        if data is None:
+            raise NoDataReceived
+        return data
+
+    with ytdl.record_writes() as (written, expirable):
+        try:
+            data = attempt()
+        except yt_dlp.DownloadError as e:
+            # Original has an unpicklable traceback
+            error = ContentUnavailable if is_unavailable(e) else \
+                yt_dlp.DownloadError
+            raise error(str(e)) from None
 
-    @staticmethod
-    def prune_cache(size_limit: int = 1024 * 1024 * 512) -> None:
-        now = datetime.now()
-        by_access: list[tuple[datetime, Path]] = []
-        sizes: dict[Path, int] = {}
+    sanitized = cast("RawData", ytdl.sanitize_info(data))
+    return (sanitized, written, expirable)
 
-        for path in CACHE_DIR.iterdir():
-            sizes[path] = path.stat().st_size
 
-        if (total_size := sum(sizes.values())) < size_limit:
-            return
+def worker_ytdl() -> CachedYoutubeDL:
+    if not hasattr(_worker, "ytdl"):
+        _worker.ytdl = CachedYoutubeDL(copy.deepcopy(YTDL_PARAMS))
+    return _worker.ytdl
 
-        for path in CACHE_DIR.iterdir():
-            try:
-                access, expire = CacheFile(path).dates()
-            except RuntimeError:
-                access, expire = None, None
-                log.exception("%r is corrupted, removing", path)
-
-            if access is None or expire is None or now >= expire:
-                path.unlink()
-                total_size -= sizes.pop(path)
-            else:
-                by_access.append((access, path))
 
-        by_access.sort(key=itemgetter(0), reverse=True)  # most recent first
+@dataclass
+class YoutubeDLPool:
+    """Bounded set of reusable CachedYoutubeDL instances, checked out per task.
+
+    Instances are closed and replaced after `max_uses` checkouts or
+    `max_age` seconds, to shed state they accumulate over time.
+    """
+
+    size: int
+    params: dict[str, Any] = field(default_factory=lambda: YTDL_PARAMS)
+    max_uses: int = 1000
+    max_age: float = 60 * 60 * 6
+    recycled: int = 0
+
+    _idle: list[CachedYoutubeDL] = field(default_factory=list)
+    _total: int = 0
+    _available: threading.Condition = \
+        field(default_factory=threading.Condition)
 
-        while total_size > size_limit * 0.66 and by_access:
-            path = by_access.pop()[1]
-            path.unlink()
-            total_size -= sizes.pop(path)
+    @contextmanager
+    def checkout(
+        self, instance: CachedYoutubeDL | None = None,
+    ) -> Iterator[CachedYoutubeDL]:
+        # Borrow any instance, or wait until a specific one is idle, which
+        # fails if it was replaced in the meantime
+        with self._available:
+            if instance:
+                while instance not in self._idle and not instance.retired:
+                    self._available.wait()
+                if instance.retired:
+                    raise InstanceRetired
+                self._idle.remove(instance)
+                ytdl: CachedYoutubeDL | None = instance
+            else:
+                while not self._idle and self._total >= self.size:
+                    self._available.wait()
+                ytdl = self._idle.pop() if self._idle else None
+                if ytdl is None:
+                    self._total += 1
+
+        try:
+            ytdl = ytdl or self._create()
+            yield ytdl
+        finally:
+            worn_out = ytdl and self._worn_out(ytdl)
+            with self._available:
+                if ytdl and not worn_out:
+                    self._idle.append(ytdl)
+                else:
+                    if ytdl:
+                        ytdl.retired = True
+                    self._total -= 1
+                # Waiters for specific instances may not be the ones woken
+                self._available.notify_all()
+            if ytdl and worn_out:
+                ytdl.close()  # its network sessions
+
+    def warm_up(self) -> None:
+        """Create all instances ahead of their first use."""
+        with self._available:
+            missing = self.size - self._total
+            self._total += missing
+
+        created = [self._create() for _ in range(missing)]
+        with self._available:
+            self._idle += created
+            self._available.notify(missing)
+        log.info("Warmed up %d YoutubeDL instances", missing)
+
+    def _create(self) -> CachedYoutubeDL:
+        # YoutubeDL keeps and writes into the params it's given
+        ytdl = CachedYoutubeDL(copy.deepcopy(self.params))
+        for ie in ("Youtube", "YoutubeTab"):  # loaded on first use otherwise
+            ytdl.get_info_extractor(ie)
+        return ytdl
+
+    def _worn_out(self, ytdl: CachedYoutubeDL) -> bool:
+        ytdl.uses += 1
+        age = time.monotonic() - ytdl.created
+
+        if ytdl.uses >= self.max_uses or age >= self.max_age:
+            self.recycled += 1
+            log.info("Recycling YoutubeDL after %d uses", ytdl.uses)
+            return True
+        return False
 
 
 @dataclass
 class YtdlpClient(YoutubeClient):
-    _ytdl_instances: ClassVar[dict[threading.Thread, CachedYoutubeDL]] = {}
+    _ytdls: ClassVar[YoutubeDLPool] = \
+        YoutubeDLPool(PARALLEL_REQUESTS_PER_HOST)
+    _metadata_ytdls: ClassVar[YoutubeDLPool] = \
+        YoutubeDLPool(PARALLEL_REQUESTS_PER_HOST, METADATA_YTDL_PARAMS)
     _pool: ClassVar[ThreadPoolExecutor] = \
         ThreadPoolExecutor(max_workers=PARALLEL_REQUESTS_PER_HOST)
+    # Fully processed extractions are CPU-bound, run them outside the GIL
+    _processes: ClassVar[ProcessPoolExecutor | None] = ProcessPoolExecutor(
+        max_workers = EXTRACT_PROCESSES,
+        mp_context = multiprocessing.get_context("spawn"),
+        initializer = worker_ytdl,
+    ) if EXTRACT_PROCESSES else None
+    _models: ClassVar[MemoryCache[ModelKey, CachedModel]] = \
+        MemoryCache(MODEL_CACHE_ENTRIES)
+    # Where to resume extractions for the next page, by URL path and page,
+    # pending until the previous page's extraction has found it
+    _cursors: ClassVar[
+        MemoryCache[tuple[str, int], Future[EntriesCursor | None]]
+    ] = MemoryCache(CURSOR_ENTRIES)
+    # Errors for URL paths that don't exist, to not retry them every time
+    _unavailable: ClassVar[MemoryCache[str, Exception]] = \
+        MemoryCache(UNAVAILABLE_ENTRIES)
+    # Default tab that worked for channel paths
+    _channel_tabs: ClassVar[MemoryCache[str, str]] = \
+        MemoryCache(CHANNEL_TAB_ENTRIES)
+    _revalidating: ClassVar[dict[ModelKey, asyncio.Task[None]]] = {}
+    _in_flight: ClassVar[dict[
+        ExtractKey, asyncio.Future[tuple[RawData, ExpireIn]],
+    ]] = {}
+    _waiting: ClassVar[Counter[ExtractKey]] = Counter()
+    # Seconds taken by recent metadata-only video extractions, not counting
+    # cache hits or callers joining an extraction in progress
+    metadata_times: ClassVar[deque[float]] = deque(maxlen=256)
+    # Request slots held until extraction threads end, lookaheads included
+    _slots: ClassVar[set[asyncio.Task[None]]] = set()
 
     @property
     def headers(self) -> dict[str, str]:
-        return self._ytdl.params["http_headers"]
+        # What every instance sends, without checking one out
+        extra = YTDL_PARAMS.get("http_headers")
+        return dict(HTTPHeaderDict(std_headers, extra))
+
+    def warm_up(self) -> None:
+        self._ytdls.warm_up()
+        self._metadata_ytdls.warm_up()
 
     @override
     async def search(
@@ -283,7 +591,7 @@ class YtdlpClient(YoutubeClient):
     ) -> Search:
         sp = (filter or SearchFilter()).url_parameter
         path = f"results?search_query={quote_plus(query)}&sp={sp}"
-        return Search.model_validate((await self._get(path, page))[0])
+        return await self._model("search", Search.model_validate, path, page)
 
     @override
     async def channel(
@@ -309,7 +617,7 @@ class YtdlpClient(YoutubeClient):
     @override
     async def playlist(self, id: str, page: int = 1) -> Playlist:
         path = f"playlist?list={id}"
-        pl = Playlist.model_validate((await self._get(path, page))[0])
+        pl = await self._model("playlist", Playlist.model_validate, path, page)
         for entry in pl:
             url = URL(entry.url).include_query_params(list=pl.id)
             if entry.nth not in {None, 1}:
@@ -320,41 +628,37 @@ class YtdlpClient(YoutubeClient):
     @override
     async def hashtag(self, tag: str, page: int = 1) -> Playlist:
         path = f"hashtag/{tag}"
-        return Playlist.model_validate((await self._get(path, page))[0])
+        validate = Playlist.model_validate
+        return await self._model("hashtag", validate, path, page)
 
     @override
-    async def video(self, id: str, skip_cache: bool = False) -> Video:
-        data, expire_in = await self._get(
-            f"watch?v={id}", process=True, skip_cache=skip_cache,
+    async def video(
+        self,
+        id: str,
+        skip_cache: bool = False,
+        fields: Collection[str] | None = None,
+    ) -> Video:
+        def validate(data: RawData) -> Video:
+            if "concurrent_view_count" in data:
+                return PartialVideo.model_validate(data)
+            return Video.model_validate(data)
+
+        path = f"watch?v={id}"
+        # If the caller's `fields` don't need playable formats, a cheaper
+        # metadata-only extraction is done, formats may then be missing
+        metadata = fields is not None and not FORMAT_FIELDS & set(fields)
+
+        if metadata and not skip_cache and \
+                (full := self._models.get(("video", path, 1))):
+            return cast("Video", full.model.model_copy(deep=True))
+
+        return await self._model(
+            "video_metadata" if metadata else "video", validate, path,
+            process = True,
+            skip_cache = skip_cache,
+            metadata = metadata,
         )
 
-        if "concurrent_view_count" in data:
-            video = PartialVideo.model_validate(data)
-        else:
-            video = Video.model_validate(data)
-
-        limit = MAX_CACHE_TIME
-        expire_in(min(video.metadata_reload_time or limit, limit))
-        return video
-
-    @property
-    def _ytdl(self) -> CachedYoutubeDL:
-        thread = threading.current_thread()
-        client = self._ytdl_instances.get(thread) or CachedYoutubeDL({
-            "quiet": True,
-            "extract_flat": "in_playlist",
-            "ignore_no_formats_error": True,  # Don't fail on premiering vids
-            "compat_opts": ["no-youtube-unavailable-videos"],
-            "extractor_args": {
-                # This client has the HLS manifests, no need for others
-                "youtube": {"player_client": ["android_vr"]},
-                # Retrieve upload dates in flat playlists
-                "youtubetab": {"approximate_date": ["timestamp"]},
-            },
-        })
-        self._ytdl_instances[thread] = client
-        return client
-
     async def _channel_tab(
         self, path: str, tab: str, search: str, page: int, sort: str = "",
     ) -> Channel:
@@ -364,8 +668,10 @@ class YtdlpClient(YoutubeClient):
             path = f"{base_path}/search?query={quote_plus(search)}"
 
         # featured tab only returns channel banner with postprocessing
-        data, _ = await self._get(path, page, process=tab == "featured")
-        channel = Channel.model_validate(data)
+        channel = await self._model(
+            "channel", Channel.model_validate, path, page,
+            process=tab == "featured",
+        )
 
         if tab == "videos" and sort == "p":
             # https://github.com/yt-dlp/yt-dlp/issues/6767
@@ -383,6 +689,8 @@ class YtdlpClient(YoutubeClient):
         sort: str = "",
     ) -> Channel:
 
+        self._raise_if_unavailable(path)
+
         if search or tab is not None:
             try:
                 return await self._channel_tab(path, tab, search, page, sort)
@@ -393,66 +701,213 @@ class YtdlpClient(YoutubeClient):
                 channel.entries.clear()
                 return channel
 
-        for tab_ in ("featured", "videos", "playlists", "streams", "shorts"):
+        if (known := self._channel_tabs.get(path)):
             try:
-                return await self._channel_tab(path, tab_, search, page, sort)
-            except yt_dlp.DownloadError as e:
-                log.warning("%s", e)
+                return await self._channel_tab(path, known, search, page, sort)
+            except (yt_dlp.DownloadError, TimeoutError) as e:
+                log.warning("%s tab of %s: %r", known, path, e)
+                self._channel_tabs.pop(path)
+
+        return await self._probe_channel_tabs(path, search, page, sort)
+
+    async def _probe_channel_tabs(
+        self, path: str, search: str, page: int, sort: str,
+    ) -> Channel:
+        # Try default tabs in parallel, the first working one in order wins
+        limit = asyncio.Semaphore(CHANNEL_PROBES)
+
+        async def probe(tab: str) -> Channel:
+            async with limit:
+                return await self._channel_tab(path, tab, search, page, sort)
 
+        probes = [asyncio.create_task(probe(t)) for t in CHANNEL_PROBE_TABS]
+        missing = True
+        try:
+            for tab, task in zip(CHANNEL_PROBE_TABS, probes, strict=True):
+                try:
+                    channel = await task
+                except (yt_dlp.DownloadError, TimeoutError) as e:
+                    log.warning("%s tab of %s: %r", tab, path, e)
+                    missing = missing and is_unavailable(e)
+                else:
+                    self._channel_tabs.put(path, tab)
+                    return channel
+        finally:
+            for task in probes:
+                task.cancel()
+                # Don't warn about failures after the result was known
+                task.add_done_callback(
+                    lambda t: t.cancelled() or t.exception(),
+                )
+
+        if missing:
+            self._remember_unavailable(path, ChannelNotFound())
         raise ChannelNotFound
 
-    def _process_entries(self, url: str, data: RawData, page: int) -> RawData:
-        tabs = [f"/{name}?" for name in Channel.tabs]
-        in_featured = URL(url).path.endswith("/featured")
-        entries: Iterable[RawData] = data["entries"]
-        gathered: list[RawData] = []
-        nth = 1
-        page_now = 1
+    async def _model(
+        self,
+        method: str,
+        validate: Callable[[RawData], M],
+        path: str,
+        page: int = 1,
+        process: bool = False,
+        skip_cache: bool = False,
+        metadata: bool = False,
+    ) -> M:
+        # Callers get copies of the cached models, stale ones while refreshed
+        key = (method, path, page)
+        now = datetime.now(UTC).timestamp()
+
+        if not skip_cache:
+            self._raise_if_unavailable(path)
+
+        if not skip_cache and (cached := self._models.get(key)):
+            if now >= cached.fresh_until:
+                args = (key, validate, path, page, process, False)
+                self._revalidate(key, self._fetch_model(*args, metadata))
+            return cast("M", cached.model.model_copy(deep=True))
+
+        args = (key, validate, path, page, process, skip_cache)
+        return await self._fetch_model(*args, metadata)
+
+    async def _fetch_model(
+        self,
+        key: ModelKey,
+        validate: Callable[[RawData], M],
+        path: str,
+        page: int,
+        process: bool,
+        skip_cache: bool,
+        metadata: bool = False,
+    ) -> M:
+        now = datetime.now(UTC).timestamp()
+        try:
+            data, expire_in = \
+                await self._get(path, page, process, skip_cache, metadata)
+        except Exception as e:
+            if is_unavailable(e):
+                self._remember_unavailable(path, e)
+            raise
+
+        model = validate(data)
+        cache_time = CACHE_POLICY.kind_ttl(key[0])
+
+        if isinstance(model, Playlist) and (changed := model.last_change):
+            age = now - changed.replace(tzinfo=UTC).timestamp()
+            if age > OLD_PLAYLIST_AGE:
+                cache_time = CACHE_POLICY.kind_ttl("old_playlist")
+
+        stale_time = cache_time + MAX_STALE_TIME
+
+        if isinstance(model, Video):
+            reload = model.metadata_reload_time
+            cache_time = min(reload or cache_time, cache_time)
+            stale_time = cache_time + MAX_STALE_TIME
+
+            if (streams_expire := model.streams_expire):
+                lifetime = streams_expire.timestamp() - now
+                refresh_in = lifetime - STREAM_REFRESH_MARGIN
+                cache_time = max(0, min(cache_time, refresh_in))
+                stale_time = min(stale_time, lifetime - STREAM_MIN_LIFETIME)
+
+        await asyncio.to_thread(expire_in, cache_time)  # writes to SQLite
+        self._models.put(
+            key,
+            CachedModel(model.model_copy(deep=True), now + cache_time),
+            expire = now + stale_time,
+        )
+        return model
+
+    def _raise_if_unavailable(self, path: str) -> None:
+        # A new exception each time, concurrent requests raising the same
+        # one would mix up its traceback and context
+        if (error := self._unavailable.get(path)) is None:
+            return
+        if isinstance(error, ChannelNotFound):
+            raise ChannelNotFound
+        raise ContentUnavailable(str(error))
+
+    def _remember_unavailable(self, path: str, error: Exception) -> None:
+        expire = datetime.now(UTC).timestamp() + UNAVAILABLE_TTL
+        self._unavailable.put(path, error, expire=expire)
+
+    def _revalidate(
+        self, key: ModelKey, refresh: Coroutine[Any, Any, Any],
+    ) -> None:
+        if key in self._revalidating:
+            refresh.close()
+            return
+
+        async def task() -> None:
+            with report(msg=f"Failed refreshing {key}"):
+                await refresh
+
+        log.info("Refreshing %s in the background", key)
+        self._revalidating[key] = asyncio.create_task(task())
+        self._revalidating[key].add_done_callback(
+            lambda _: self._revalidating.pop(key, None),
+        )
+
+    def _process_entries(
+        self,
+        ytdl: CachedYoutubeDL,
+        path: str,
+        data: RawData,
+        page: int,
+        cursor: EntriesCursor | None,
+        page_done: Callable[[list[RawData]], None],
+    ) -> RawData:
+        # Pages are delimited by the requests made between entries
+        in_featured = URL(path).path.endswith("/featured")
+        entries: Iterator[RawData] = \
+            cursor.entries if cursor else iter(data["entries"])
+        first = [cursor.first] if cursor and cursor.first else []
+        nth = cursor.nth if cursor else 1
+        page_now = page if cursor else 1
         got_page_data = False
+        gathered: list[RawData] = []
 
         def process(entry: RawData) -> RawData:
-            extra: RawData = {"nth": nth}
-
-            if "/shorts/" in entry["url"]:
-                etype = ShortEntry
-            elif entry["url"].endswith("/posts"):
-                etype = FeaturedChannelPosts
-            elif "/channel/" in entry["url"]:
-                etype = ChannelEntry
-            elif "/playlist?" in entry["url"]:
-                etype = PlaylistEntry
-                if in_featured:
-                    etype = FeaturedChannelPlaylist
+            etype = _entry_type(entry, in_featured)
+            extra: RawData = {"nth": nth, "entry_type": etype.__name__}
+            if etype in {PlaylistEntry, FeaturedChannelPlaylist}:
                 extra["id"] = entry.get("id") or \
                     parse_qs(URL(entry["url"]).query)["list"][-1]
-            elif any(name in entry["url"] for name in tabs):
-                etype = FeaturedChannelTab
-            elif "concurrent_view_count" in entry:
-                etype = PartialEntry
-            else:
-                etype = VideoEntry
-
-            extra["entry_type"] = etype.__name__
             return entry | extra
 
-        class Interrupt(Exception):
-            ...
-
-        def interrupt(_: YtdlpRequest) -> None:
+        def on_request(_: YtdlpRequest) -> None:
             nonlocal page_now, got_page_data
             if got_page_data:
                 page_now += 1
                 got_page_data = False
-            if page_now > page:
-                raise Interrupt
+                if page_now == page + 1:
+                    page_done(gathered)
 
-        with suppress(Interrupt), self._ytdl.before_requests(interrupt):
-            for entry in entries:
-                got_page_data = True
-                if page_now == page:
-                    gathered.append(process(entry))
-                nth += 1
+        # Registered before this page is delivered, so that requests for the
+        # next one wait for this lookahead instead of starting over
+        pending: Future[EntriesCursor | None] = Future()
+        expire = datetime.now(UTC).timestamp() + CURSOR_LIFETIME
+        self._cursors.put((path, page + 1), pending, expire=expire)
+        next_cursor = EntriesCursor(ytdl, data, iter(()), nth, None)
 
+        try:
+            with ytdl.before_requests(on_request):
+                for entry in chain(first, entries):
+                    if page_now > page:
+                        next_cursor = \
+                            EntriesCursor(ytdl, data, entries, nth, entry)
+                        break
+                    got_page_data = True
+                    if page_now == page:
+                        gathered.append(process(entry))
+                    nth += 1
+                else:
+                    next_cursor.nth = nth
+        except BaseException:
+            pending.set_result(None)
+            raise
+
+        pending.set_result(next_cursor)
         return data | {"entries": gathered}
 
     async def _get(
@@ -461,26 +916,209 @@ class YtdlpClient(YoutubeClient):
         page: int = 1,
         process: bool = False,
         skip_cache: bool = False,
+        metadata: bool = False,
+    ) -> tuple[RawData, ExpireIn]:
+        # Identical parallel calls share one extraction, which is only
+        # cancelled once all of its callers are
+        key: ExtractKey = (path, page, process, skip_cache, metadata)
+
+        if (future := self._in_flight.get(key)) is None:
+            future = asyncio.ensure_future(self._extract(*key))
+            self._in_flight[key] = future
+
+            def forget(future: asyncio.Future[Any]) -> None:
+                self._in_flight.pop(key, None)
+                if not future.cancelled():
+                    future.exception()  # don't warn if all callers are gone
+
+            future.add_done_callback(forget)
+
+        self._waiting[key] += 1
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+                future.cancel()
+
+    async def _extract(  # noqa: PLR0915
+        self,
+        path: str,
+        page: int,
+        process: bool,
+        skip_cache: bool,
+        metadata: bool,
     ) -> tuple[RawData, ExpireIn]:
 
         loop = asyncio.get_event_loop()
         url = f"https://youtube.com/{path}"
-
-        @backoff.on_exception(backoff.expo, NoDataReceived, max_tries=10)
-        def task():
-            with self._ytdl.adjust_cache_expiration() as expire_in:
-                with self._ytdl.skip_cache(skip_cache):
-                    if (data := self._ytdl.extract_info(
+        ytdls = self._metadata_ytdls if metadata else self._ytdls
+        deadline = Deadline(time.time() + EXTRACT_TIMEOUT)
+
+        # Only videos: entries of lists need _process_entries in this process
+        if process and self._processes and not metadata and \
+                path.startswith("watch?"):
+            return await self._extract_in_process(url, skip_cache, deadline)
+
+        cursor = None if skip_cache else \
+            await self._cursor(path, page, deadline)
+        result: asyncio.Future[tuple[RawData, ExpireIn]] = loop.create_future()
+        finished: asyncio.Future[None] = loop.create_future()
+        delivered = False
+
+        def deliver(value: tuple[RawData, ExpireIn]) -> None:
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                # The next page's lookahead gets its own time limit
+                deadline.extend(EXTRACT_TIMEOUT)
+                loop.call_soon_threadsafe(_settle, result, value)
+
+        @backoff.on_exception(
+            backoff.expo,
+            NoDataReceived,
+            max_tries = 10,
+            max_time = deadline.remaining,
+        )
+        def task() -> tuple[RawData, ExpireIn]:
+            deadline.check()
+            # Paused iterations keep using the instance that started them,
+            # once no other extraction is using it
+            if cursor:
+                with suppress(InstanceRetired), \
+                        ytdls.checkout(cursor.ytdl) as ytdl:
+                    return extract(ytdl, cursor)
+            with ytdls.checkout() as ytdl:
+                return extract(ytdl, None)
+
+        def extract(
+            ytdl: CachedYoutubeDL, cursor: EntriesCursor | None,
+        ) -> tuple[RawData, ExpireIn]:
+            with ytdl.until(deadline), \
+                    ytdl.adjust_cache_expiration() as expire_in:
+                with ytdl.skip_cache(skip_cache):
+                    if cursor:
+                        data = cursor.data
+                    elif (data := ytdl.extract_info(
                         url, process=process, download=False,
                     )) is None:
                         raise NoDataReceived
 
                 if "entries" not in data:
                     return (data, expire_in)
-                return (self._process_entries(url, data, page), expire_in)
 
-        async with max_parallel_requests(url):
-            return await loop.run_in_executor(self._pool, task)
+                def page_done(entries: list[RawData]) -> None:
+                    deliver((data | {"entries": entries}, expire_in))
+
+                return (
+                    self._process_entries(
+                        ytdl, path, data, page, cursor, page_done,
+                    ),
+                    expire_in,
+                )
+
+        def run() -> None:
+            try:
+                deliver(task())
+            except Exception as e:
+                if delivered:  # only the following page's prefetch failed
+                    log.exception("Failed fetching next page of %s", url)
+                else:
+                    loop.call_soon_threadsafe(_fail, result, e)
+            finally:
+                loop.call_soon_threadsafe(_settle, finished, None)
+
+        self._run_in_slot(url, run, finished, deadline)
+        try:
+            async with asyncio.timeout(deadline.remaining()):
+                value = await result
+        except (asyncio.CancelledError, TimeoutError):
+            deadline.cancelled.set()  # free the thread and YoutubeDL
+            result.cancel()  # nobody will retrieve its outcome
+            raise
+
+        if metadata:
+            self.metadata_times.append(time.time() - deadline.started)
+        return value
+
+    async def _cursor(
+        self, path: str, page: int, deadline: Deadline,
+    ) -> EntriesCursor | None:
+        cursor = None
+        if (pending := self._cursors.pop((path, page))):
+            # The previous page's extraction may still be looking for it
+            with suppress(TimeoutError):
+                async with asyncio.timeout(deadline.remaining()):
+                    cursor = await asyncio.shield(asyncio.wrap_future(pending))
+
+        if page > 1 and not cursor:
+            log.debug("No cursor for page %d of %s, starting over", page, path)
+        return cursor
+
+    async def _extract_in_process(
+        self, url: str, skip_cache: bool, deadline: Deadline,
+    ) -> tuple[RawData, ExpireIn]:
+        assert self._processes
+        loop = asyncio.get_event_loop()
+        # Workers can't be told about cancellations, only the deadline
+        async with max_parallel_requests(url), \
+                asyncio.timeout(deadline.remaining()):
+            data, written, expirable = await loop.run_in_executor(
+                self._processes,
+                extract_in_worker, url, skip_cache, deadline.at,
+            )
+        track = partial(RESPONSE_CACHE.track, written)
+        await loop.run_in_executor(self._pool, track)
+        return (data, partial(RESPONSE_CACHE.expire_in, expirable))
+
+    def _run_in_slot(
+        self,
+        url: str,
+        run: Callable[[], None],
+        finished: asyncio.Future[None],
+        deadline: Deadline,
+    ) -> None:
+        # The page can be returned while the next one starts being fetched,
+        # that lookahead still counts as a parallel request until it's done
+        async def hold_slot() -> None:
+            async with max_parallel_requests(url):
+                if not deadline.cancelled.is_set():
+                    self._pool.submit(run)
+                    await finished
+
+        slot = asyncio.create_task(hold_slot())
+        self._slots.add(slot)
+        slot.add_done_callback(self._slots.discard)
+
+
+def benchmark_extraction(
+    video_ids: list[str], processes: int, rounds: int = 5,
+) -> None:
+    """Compare thread and process pool throughput for video extraction.
+
+    Responses are cached beforehand, only extraction work is measured.
+    """
+    urls = [f"https://youtube.com/watch?v={id}" for id in video_ids]
+    for url in urls:
+        extract_in_worker(url)
+
+    pools: dict[str, Executor] = {
+        f"{PARALLEL_REQUESTS_PER_HOST} threads":
+            ThreadPoolExecutor(PARALLEL_REQUESTS_PER_HOST),
+        f"{processes} processes": ProcessPoolExecutor(
+            processes,
+            mp_context = multiprocessing.get_context("spawn"),
+            initializer = worker_ytdl,
+        ),
+    }
+    for name, pool in pools.items():
+        with pool:
+            list(pool.map(extract_in_worker, urls))  # warm up all workers
+            start = time.perf_counter()
+            list(pool.map(extract_in_worker, urls * rounds))
+            speed = len(urls) * rounds / (time.perf_counter() - start)
+            print(f"{name:<16} {speed:>8.1f} extractions/s")
 
 
 YTDLP = YtdlpClient()
@@ -6,25 +6,45 @@ from __future__ import annotations
 import asyncio
 import logging as log
 import math
+import os
+import pickle  # noqa: S403
 import random
 import re
 from collections import Counter, deque
-from dataclasses import dataclass, field
+from collections.abc import Callable, Coroutine
+from dataclasses import dataclass, field, fields
+from datetime import UTC, datetime
+from functools import cache
 from itertools import islice
-from typing import TYPE_CHECKING, Any, ClassVar, Generic, Self, TypeVar
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    ClassVar,
+    Generic,
+    Self,
+    TypeAlias,
+    TypeVar,
+    cast,
+)
 from uuid import UUID, uuid4
 
+from fastapi.datastructures import URL
+from pydantic import BaseModel
+from typing_extensions import override
 from yt_dlp.utils import DownloadError
 
+from insidious.extractors.cache import CACHE_DIR, MemoryCache, SQLiteDatabase
 from insidious.extractors.filters import SearchFilter, Type
 
 from .extractors.data import (
+    ChannelEntry,
     FeaturedChannelPosts,
     FeaturedChannelTab,
     Playlist,
     PlaylistEntry,
     Search,
     ShortEntry,
+    Thumbnail,
     VideoEntry,
 )
 from .extractors.ytdlp import YTDLP
@@ -34,15 +54,223 @@ if TYPE_CHECKING:
     from collections.abc import Sequence
 
     from fastapi import Request
-    from fastapi.datastructures import URL
 
 T = TypeVar("T")
+P = TypeVar("P", bound="Pagination[Any]")
+Fetcher: TypeAlias = Callable[[int], Coroutine[Any, Any, Any]]
 NON_WORD_CHARS = re.compile(r"\W+")
+PAGINATION_MEMORY = 1024 * 1024 * 64
+PAGINATION_TTL = 60 * 30
+PAGINATION_BASE_SIZE = 1024 * 4  # request and bookkeeping, roughly
+PAGINATION_STORE = os.getenv("INSIDIOUS_PAGINATION_STORE") or "memory"
+PREFETCH = int(os.getenv("INSIDIOUS_PREFETCH") or 0)
+PREFETCH_ENTRIES = 256
+PLAYLIST_INDEX_AGE = 60 * 60 * 24 * 30
+# Fields of paginated models that no page shows, not kept
+UNRENDERED_FIELDS: dict[type[BaseModel], frozenset[str]] = {
+    Thumbnail: frozenset({"id", "height"}),
+    VideoEntry: frozenset({
+        "description", "channel_id", "channel_followers", "uploader_id",
+        "uploader_name",
+    }),
+    ChannelEntry: frozenset({"uploader_id", "channel_id"}),
+}
+
+
+@dataclass
+class PaginationStore:
+    """Where unfinished paginations are kept between their requests.
+
+    Paginations are dropped after `PAGINATION_TTL` seconds without
+    requests, or least recently used first when their estimated total size
+    exceeds `PAGINATION_MEMORY`.
+    """
+
+    def load(
+        self, cls: type[P], request: Request, id: UUID,
+    ) -> P | None:
+        raise NotImplementedError
+
+    def save(self, pagination: Pagination[Any]) -> None:
+        raise NotImplementedError
+
+    def drop(self, id: UUID) -> None:
+        raise NotImplementedError
+
+    def prune(self) -> None:
+        raise NotImplementedError
+
+
+@dataclass
+class MemoryPaginationStore(PaginationStore):
+    """Live pagination objects, only usable by a single server process."""
+
+    _instances: MemoryCache[UUID, Any] = \
+        field(default_factory=lambda: MemoryCache(PAGINATION_MEMORY))
+
+    @override
+    def load(
+        self, cls: type[P], request: Request, id: UUID,
+    ) -> P | None:
+        return self._instances.get(id)
+
+    @override
+    def save(self, pagination: Pagination[Any]) -> None:
+        expire = datetime.now(UTC).timestamp() + PAGINATION_TTL
+        size = pagination.estimated_size
+        self._instances.put(pagination.id, pagination, size, expire)
+
+    @override
+    def drop(self, id: UUID) -> None:
+        self._instances.pop(id)
+
+    @override
+    def prune(self) -> None:
+        self._instances.prune_expired()
+        kept = self._instances
+        log.info(
+            "Paginations: %d kept, ~%d bytes, %d expired, %d evicted, "
+            "%d resumed",
+            len(kept), kept.size, kept.expirations, kept.evictions,
+            Pagination.resumed,
+        )
+
+
+@dataclass
+class SQLitePaginationStore(PaginationStore, SQLiteDatabase):
+    """Serialized paginations in a database shared by server processes."""
+
+    schema: ClassVar[str] = """
+        CREATE TABLE IF NOT EXISTS paginations (
+            id TEXT PRIMARY KEY,
+            state BLOB NOT NULL,
+            expire REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS paginations_expire
+            ON paginations (expire);
+    """
+
+    @override
+    def load(
+        self, cls: type[P], request: Request, id: UUID,
+    ) -> P | None:
+        now = datetime.now(UTC).timestamp()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT state FROM paginations WHERE id = ? AND expire > ?",
+                (str(id), now),
+            ).fetchone()
+        if not row:
+            return None
+        # Only ever written by this program from its own objects
+        return cls(request, **pickle.loads(row[0]))  # noqa: S301
+
+    @override
+    def save(self, pagination: Pagination[Any]) -> None:
+        state = pickle.dumps(pagination.state)
+        expire = datetime.now(UTC).timestamp() + PAGINATION_TTL
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO paginations VALUES (?, ?, ?)",
+                (str(pagination.id), state, expire),
+            )
+
+    @override
+    def drop(self, id: UUID) -> None:
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM paginations WHERE id = ?", (str(id),),
+            )
+
+    @override
+    def prune(self) -> None:
+        now = datetime.now(UTC).timestamp()
+        with self._lock:
+            expired = self._db.execute(
+                "DELETE FROM paginations WHERE expire <= ?", (now,),
+            ).rowcount
+            # Those that expire soonest are the least recently used
+            evicted = self._db.execute("""
+                DELETE FROM paginations WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, SUM(LENGTH(state)) OVER (
+                            ORDER BY expire DESC
+                        ) AS total FROM paginations
+                    ) WHERE total > ?
+                )
+            """, (PAGINATION_MEMORY,)).rowcount
+            kept, size = self._db.execute(
+                "SELECT COUNT(*), TOTAL(LENGTH(state)) FROM paginations",
+            ).fetchone()
+        log.info(
+            "Paginations: %d kept, %d bytes, %d expired, %d evicted, "
+            "%d resumed",
+            kept, size, expired, evicted, Pagination.resumed,
+        )
+
+
+@cache
+def _kept_fields(model: type[BaseModel]) -> tuple[str, ...]:
+    dropped = frozenset().union(
+        *(UNRENDERED_FIELDS.get(cls, ()) for cls in model.__mro__),
+    )
+    return tuple(name for name in model.model_fields if name not in dropped)
+
+
+@dataclass(slots=True, frozen=True)
+class CompactEntry:
+    """Values of a model's rendered fields, without the model's overhead.
+
+    Paginations keep many entries around, they only become models again
+    for the page that shows them.
+    """
+
+    model: type[BaseModel]
+    values: tuple[Any, ...]
+
+    @classmethod
+    def pack(cls, model: BaseModel) -> CompactEntry:
+        return cls(type(model), tuple(
+            cls._pack_value(getattr(model, name))
+            for name in _kept_fields(type(model))
+        ))
+
+    def unpack(self) -> Any:
+        names = _kept_fields(self.model)
+        return self.model.model_construct(**{
+            name: self._unpack_value(value)
+            for name, value in zip(names, self.values, strict=True)
+        })
+
+    @classmethod
+    def _pack_value(cls, value: Any) -> Any:
+        if isinstance(value, BaseModel):
+            return cls.pack(value)
+        if isinstance(value, list):
+            return tuple(cls._pack_value(v) for v in value)
+        return value
+
+    @classmethod
+    def _unpack_value(cls, value: Any) -> Any:
+        if isinstance(value, CompactEntry):
+            return value.unpack()
+        if isinstance(value, tuple):
+            return [cls._unpack_value(v) for v in value]
+        return value
 
 
 @dataclass(slots=True)
 class Pagination(Generic[T]):
-    _instances: ClassVar[dict[UUID, Self]] = {}
+    """Items gathered for a paginated page, kept between its requests.
+
+    When a pagination was dropped from the store, the request for its next
+    page starts a new one where it was.
+    """
+
+    store: ClassVar[PaginationStore] = \
+        SQLitePaginationStore(CACHE_DIR / "paginations.sqlite3") \
+        if PAGINATION_STORE == "sqlite" else MemoryPaginationStore()
+    resumed: ClassVar[int] = 0
 
     request: Request
     id: UUID
@@ -50,14 +278,20 @@ class Pagination(Generic[T]):
     per_page: int = 12
     find_attr: tuple[str, Any] | None = None
     continuation_id: str | None = None
+    skip: int = 0  # items of the next added page that were already shown
+    fetcher: Fetcher | None = field(default=None, repr=False)
 
     found_item: T | None = None
 
-    _data: deque[T] = field(default_factory=deque)
+    _data: deque[T | CompactEntry] = field(default_factory=deque)
     _done: bool = False
-
-    def __post_init__(self) -> None:
-        self._instances[self.id] = self
+    _item_size: int = 0
+    # Position of items in everything fetched since the first added page
+    _fetched: int = 0
+    _shown: int = 0
+    _page_starts: deque[tuple[int, int]] = field(default_factory=deque)
+    # Current page's items, unpacked once until the page changes
+    _items: list[T] | None = field(default=None, repr=False)
 
     @property
     def done(self) -> bool:
@@ -66,14 +300,29 @@ class Pagination(Generic[T]):
     @done.setter
     def done(self, value: bool) -> None:
         self._done = value
-        if value:
-            self._instances.pop(self.id, None)
-        else:
-            self._instances[self.id] = self
+
+    @property
+    def state(self) -> dict[str, Any]:
+        # These aren't serializable, the next request gives them again
+        unsaved = {"request", "fetcher", "_items"}
+        return {
+            f.name: getattr(self, f.name)
+            for f in fields(self) if f.name not in unsaved
+        }
+
+    @property
+    def estimated_size(self) -> int:
+        return PAGINATION_BASE_SIZE + len(self._data) * self._item_size
 
     @property
     def items(self) -> list[T]:
-        return list(islice(self._data, 0, self.per_page))
+        if self._items is None:
+            self._items = [
+                cast("T", item.unpack() if isinstance(item, CompactEntry)
+                     else item)
+                for item in islice(self._data, 0, self.per_page)
+            ]
+        return self._items
 
     @property
     def needs_more_data(self) -> bool:
@@ -91,16 +340,37 @@ class Pagination(Generic[T]):
     def next_url(self) -> URL | None:
         if self.done:
             return None
+
+        # Where to start again if this pagination gets dropped before then:
+        # the fetched page holding the first item after this one, and how
+        # many of its items come before
+        page, skip = self.page, 0
+        position = self._shown + min(len(self._data), self.per_page)
+        if position < self._fetched and not self.continuation_id:
+            page, start = next(
+                (p, s) for p, s in reversed(self._page_starts)
+                if s <= position
+            )
+            skip = position - start
+
         params = {k: v for k, v in {
-            "page": self.page,
+            "page": page,
+            "skip": skip or None,
             "pagination_id": self.id,
             "continuation_id": self.continuation_id,
         }.items() if v is not None}
-        return self.request.url.include_query_params(**params)
+        url = self.request.url.remove_query_params("skip")
+        return url.include_query_params(**params)
 
     def advance(self) -> Self:
+        self._items = None
         for _ in range(min(len(self._data), self.per_page)):
             self._data.popleft()
+            self._shown += 1
+
+        starts = self._page_starts
+        while len(starts) > 1 and starts[1][1] <= self._shown:
+            starts.popleft()
         return self
 
     def add(self, items: Sequence[T]) -> Self:
@@ -108,25 +378,51 @@ class Pagination(Generic[T]):
             self.done = True
             return self
 
+        self._items = None
+        self._page_starts.append((self.page, self._fetched))
+        self._fetched += len(items)
+        if self.skip:
+            # Already shown before this pagination was dropped and resumed
+            self._shown += min(self.skip, len(items))
+            items, self.skip = list(items)[self.skip:], 0
+
+        kept: list[T | CompactEntry] = [
+            CompactEntry.pack(item) if isinstance(item, BaseModel) else item
+            for item in items
+        ]
+        if kept and isinstance(kept[0], CompactEntry):
+            self._item_size = max(self._item_size, len(pickle.dumps(kept[0])))
+
         if self.finding:
             assert self.find_attr
             attr, value = self.find_attr
-            for item in items:
+            for item, compact in zip(items, kept, strict=True):
                 if getattr(item, attr, None) == value:
-                    self.found_item = item
+                    # Equal to the entry that will be shown, for highlighting
+                    self.found_item = compact.unpack() \
+                        if isinstance(compact, CompactEntry) else item
                     break
 
-        self._data += items
+        self._data += kept
         self.page += 1
         return self
 
     def reset(self) -> None:
+        self._items = None
         self._data.clear()
+        self._page_starts.clear()
+        self._fetched = self._shown = 0
         self.page = 1
         self.done = False
 
+    async def fetch(self) -> Any:
+        """Get the next page from `fetcher`, prefetched if possible."""
+        return await PREFETCHER.fetch(self)
+
     @classmethod
-    def get(cls, request: Request) -> Self:
+    async def get(
+        cls, request: Request, fetcher: Fetcher | None = None,
+    ) -> Self:
         id = UUID(request.query_params.get("pagination_id") or str(uuid4()))
         page = max(1, int(request.query_params.get("page") or 1))
         kws = {}
@@ -137,15 +433,181 @@ class Pagination(Generic[T]):
         if (cid := request.query_params.get("continuation_id")):
             kws["continuation_id"] = cid
 
+        if (skip := request.query_params.get("skip")):
+            kws["skip"] = max(0, int(skip))
+
         find = request.query_params.get("find_attr") or None
         if isinstance(find, str):
             attr, value = find.split(":", 1)
             find = (attr, value)
 
-        if id in cls._instances:
-            return cls._instances[id]
+        if "pagination_id" in request.query_params:
+            load = cls.store.load
+            if (found := await asyncio.to_thread(load, cls, request, id)):
+                found.fetcher = fetcher
+                return found
+            log.info("Pagination %s dropped, resuming at page %d", id, page)
+            Pagination.resumed += 1
+
+        return cls(request, id, page, **kws, find_attr=find, fetcher=fetcher)
+
+    def save(self) -> None:
+        """Store this pagination until its next page, call once it's final.
+
+        Paginations that are done are removed from the store instead.
+        """
+        if self.done:
+            self.store.drop(self.id)
+        else:
+            self.store.save(self)
+
+
+@dataclass
+class Prefetcher:
+    """Fetch the next page of paginations that are about to run out.
+
+    Once a served page leaves a pagination running short, its next page is
+    fetched in the background and kept for the request that will ask for
+    it. At most `concurrency` prefetches run at once across all
+    paginations, 0 disables prefetching.
+    """
+
+    concurrency: int = PREFETCH
+    started: int = 0
+    used: int = 0
+
+    _pages: MemoryCache[tuple[UUID, int], asyncio.Task[Any]] = field(
+        init=False, default_factory=lambda: MemoryCache(PREFETCH_ENTRIES),
+    )
+    _running: set[asyncio.Task[Any]] = field(init=False, default_factory=set)
+
+    def prefetch(self, pagination: Pagination[Any]) -> None:
+        key = (pagination.id, pagination.page)
+        if not pagination.fetcher or not pagination.running_short or \
+                len(self._running) >= self.concurrency or \
+                self._pages.get(key):
+            return
+
+        task = asyncio.create_task(pagination.fetcher(pagination.page))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+        task.add_done_callback(self._unretrieved)
+
+        expire = datetime.now(UTC).timestamp() + PAGINATION_TTL
+        self._pages.put(key, task, expire=expire)
+        self.started += 1
+
+    @staticmethod
+    def _unretrieved(task: asyncio.Task[Any]) -> None:
+        # Don't warn about failures of pages that end up never requested
+        if not task.cancelled():
+            task.exception()
+
+    async def fetch(self, pagination: Pagination[Any]) -> Any:
+        assert pagination.fetcher
+        if (task := self._pages.pop((pagination.id, pagination.page))):
+            self.used += 1
+            return await task
+        return await pagination.fetcher(pagination.page)
+
+    def prune(self) -> None:
+        self._pages.prune_expired()
+        log.info(
+            "Prefetched pages: %d started, %d used, %d running",
+            self.started, self.used, len(self._running),
+        )
+
+
+PREFETCHER = Prefetcher()
+
+
+@dataclass
+class PlaylistIndex(SQLiteDatabase):
+    """Which page of their playlists videos were last seen on.
+
+    Lets a pagination finding a video in a long playlist start from the
+    page that has it, rather than going through every page before.
+    """
+
+    schema: ClassVar[str] = """
+        CREATE TABLE IF NOT EXISTS pages (
+            playlist TEXT NOT NULL,
+            video TEXT NOT NULL,
+            page INTEGER NOT NULL,
+            seen REAL NOT NULL,
+            PRIMARY KEY (playlist, video)
+        );
+        CREATE INDEX IF NOT EXISTS pages_seen ON pages (seen);
+    """
+
+    max_age: float = PLAYLIST_INDEX_AGE
+    jumps: int = 0
+    misses: int = 0
+
+    def page(self, playlist_id: str, video_id: str) -> int | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT page FROM pages WHERE playlist = ? AND video = ?",
+                (playlist_id, video_id),
+            ).fetchone()
+        return row[0] if row else None
+
+    def learn(self, playlist: Playlist, page: int) -> None:
+        now = datetime.now(UTC).timestamp()
+        rows = [
+            (playlist.id, entry.id, page, now)
+            for entry in playlist if entry.id
+        ]
+        with self._lock:
+            # One transaction, not one per row
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", rows,
+                )
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def forget(self, playlist_id: str, video_id: str) -> None:
+        """Forget a video's page after it wasn't found there."""
+        self.misses += 1
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM pages WHERE playlist = ? AND video = ?",
+                (playlist_id, video_id),
+            )
+
+    def seek(self, pagination: Pagination[Any], playlist_id: str) -> bool:
+        """Move a new pagination finding a video to the page that has it.
+
+        Returns whether the pagination was moved.
+        """
+        if not pagination.finding or not pagination.needs_more_data or \
+                pagination.page != 1:
+            return False
+
+        assert pagination.find_attr
+        attr, value = pagination.find_attr
+        if attr != "id" or not (page := self.page(playlist_id, value)):
+            return False
+
+        pagination.page = page
+        self.jumps += 1
+        return True
+
+    def prune(self) -> None:
+        oldest = datetime.now(UTC).timestamp() - self.max_age
+        with self._lock:
+            self._db.execute("DELETE FROM pages WHERE seen < ?", (oldest,))
+        log.info(
+            "Playlist index: %d jumps to a video's page, %d missed",
+            self.jumps, self.misses,
+        )
+
 
-        return cls(request, id, page, **kws, find_attr=find)
+PLAYLIST_INDEX = PlaylistIndex(CACHE_DIR / "playlist_pages.sqlite3")
 
 
 @dataclass(slots=True)
@@ -325,6 +787,9 @@ class RelatedPagination(Pagination[ShortEntry | VideoEntry]):
                  len(self.current_batch), self.page, self.video_name)
 
         by_score = sorted(self.current_batch.values())
+        for related in by_score:
+            url = URL(related.entry.url).remove_query_params(("list", "index"))
+            related.entry.url = str(url)
         self.add([related.entry for related in reversed(by_score)])
         self.current_batch.clear()
         self.batch_playlists.clear()
@@ -0,0 +1,103 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import UTC, datetime
+from enum import auto
+from typing import ClassVar
+
+from .extractors.cache import CACHE_DIR, MemoryCache, SQLiteDatabase
+from .extractors.ytdlp import UNAVAILABLE_TTL
+from .utils import AutoStrEnum
+
+PATH_KIND_ENTRIES = 1024 * 16
+
+
+class PathKind(AutoStrEnum):
+    video = auto()
+    channel = auto()
+    none = auto()
+
+
+@dataclass
+class PathResolver(SQLiteDatabase):
+    """What kind of page each path of the catch-all route turned out to be.
+
+    Found kinds are remembered for `ttl` seconds, paths leading nowhere for
+    `none_ttl` seconds. The most recently used are kept in memory, others
+    are looked up in the database, other server processes may have learned
+    them.
+    """
+
+    schema: ClassVar[str] = """
+        CREATE TABLE IF NOT EXISTS kinds (
+            path TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            learned REAL NOT NULL
+        );
+    """
+
+    ttl: float = 60 * 60 * 24 * 30
+    none_ttl: float = UNAVAILABLE_TTL
+
+    _kinds: MemoryCache[str, PathKind] = field(
+        init=False, default_factory=lambda: MemoryCache(PATH_KIND_ENTRIES),
+    )
+
+    def __post_init__(self) -> None:
+        super().__post_init__()
+        self.prune()
+
+    def get(self, path: str) -> PathKind | None:
+        if (kind := self._kinds.get(path)) is not None:
+            return kind
+
+        with self._lock:
+            row = self._db.execute(
+                "SELECT kind, learned FROM kinds WHERE path = ?", (path,),
+            ).fetchone()
+        if row is None:
+            return None
+
+        kind = PathKind(row[0])
+        expire = row[1] + self._ttl(kind)
+        if datetime.now(UTC).timestamp() >= expire:
+            self.forget(path)
+            return None
+        self._kinds.put(path, kind, expire=expire)
+        return kind
+
+    def learn(self, path: str, kind: PathKind) -> None:
+        if self._kinds.get(path) == kind:
+            return
+
+        now = datetime.now(UTC).timestamp()
+        self._kinds.put(path, kind, expire=now + self._ttl(kind))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO kinds VALUES (?, ?, ?)",
+                (path, kind.value, now),
+            )
+
+    def forget(self, path: str) -> None:
+        self._kinds.pop(path)
+        with self._lock:
+            self._db.execute("DELETE FROM kinds WHERE path = ?", (path,))
+
+    def prune(self) -> None:
+        now = datetime.now(UTC).timestamp()
+        self._kinds.prune_expired()
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM kinds WHERE learned < ? "
+                "OR (kind = ? AND learned < ?)",
+                (now - self.ttl, PathKind.none.value, now - self.none_ttl),
+            )
+
+    def _ttl(self, kind: PathKind) -> float:
+        return self.none_ttl if kind == PathKind.none else self.ttl
+
+
+PATH_KINDS = PathResolver(CACHE_DIR / "paths.sqlite3")
@@ -0,0 +1,300 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import json
+from datetime import UTC, datetime, timedelta
+from email.utils import format_datetime
+from typing import TYPE_CHECKING
+
+import pytest
+from yt_dlp.networking.common import Request as YtdlpRequest
+
+from insidious.extractors import cache
+from insidious.extractors.cache import (
+    CachedResponse,
+    CacheIndex,
+    CachePolicy,
+    MemoryCache,
+    ResponseCache,
+    normalize_body,
+    upstream_ttl,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+BROWSE = "https://www.youtube.com/youtubei/v1/browse?prettyPrint=false"
+
+
+def response(data: bytes = b"body", ttl: float = 60) -> CachedResponse:
+    expire = datetime.now(UTC).timestamp() + ttl
+    return CachedResponse(
+        "https://example.com", {"Content-Type": "text/html"}, 200, "OK",
+        data, expire,
+    )
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> ResponseCache:
+    store = ResponseCache(tmp_path / "responses.sqlite3")
+    store._legacy_removed = True
+    return store
+
+
+def test_response_round_trip(store: ResponseCache) -> None:
+    written = response(b"x" * 1000)
+    store.write("a", written)
+    assert store.response("a") == written
+    assert store.response("b") is None
+
+
+def test_response_replaced(store: ResponseCache) -> None:
+    store.write("a", response(b"old"))
+    store.write("a", response(b"new"))
+    assert (found := store.response("a"))
+    assert found.data == b"new"
+
+
+def test_expired_response_ignored(store: ResponseCache) -> None:
+    store.write("a", response(ttl=-1))
+    assert store.response("a") is None
+
+
+def test_remove(store: ResponseCache) -> None:
+    store.write("a", response())
+    store.write("b", response())
+    store.remove(["a"])
+    assert store.response("a") is None
+    assert store.response("b")
+
+
+def test_legacy_files_removed(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(cache, "CACHE_DIR", tmp_path)
+    legacy = tmp_path / ("0" * 32)
+    legacy.write_bytes(b"")
+    kept = tmp_path / "responses.sqlite3"
+
+    ResponseCache(kept).prune(2**40, 2**40, 10)
+    assert not legacy.exists()
+    assert kept.exists()
+
+
+def test_index_sizes() -> None:
+    index = CacheIndex()
+    index.set("a", 10, 1, 100)
+    index.set("b", 20, 2, 100)
+    index.set("a", 5, 3, 100)
+    assert index.total_size == 25
+    index.discard("b")
+    index.discard("b")
+    assert index.total_size == 5
+
+
+def test_index_pops_expired_in_order() -> None:
+    index = CacheIndex()
+    index.set("a", 1, 0, 30)
+    index.set("b", 1, 0, 10)
+    index.set("c", 1, 0, 50)
+    index.expire_at("c", 20)
+    assert list(index.pop_expired(25)) == ["b", "c"]
+    assert set(index.entries) == {"a"}
+
+
+def test_index_pops_least_recent() -> None:
+    index = CacheIndex()
+    for i, key in enumerate("abc"):
+        index.set(key, 1, i, 100)
+    index.touch("a", 10)
+    assert [index.pop_least_recent() for _ in range(4)] == \
+        ["b", "c", "a", None]
+    assert index.total_size == 0
+
+
+def test_index_heaps_stay_bounded() -> None:
+    index = CacheIndex()
+    index.set("a", 1, 0, 100)
+    for i in range(5000):
+        index.touch("a", i)
+    assert len(index._by_access) <= 1024 + 3
+    assert index.pop_least_recent() == "a"
+
+
+def test_prune_by_index(store: ResponseCache) -> None:
+    for i in range(10):
+        store.write(str(i), response(bytes(100), ttl=-1 if i < 2 else 60))
+    store.response("2")  # most recently used now
+    size = store._load_index().entries["2"].size
+
+    assert not store.prune(size * 10, size * 5, 100)  # under high mark
+    assert not store.prune(size * 7, size * 5, 100)
+    assert store.response("2")
+    assert store._total_size() == size * 5
+    assert store._load_index().total_size == size * 5
+    assert sorted(store._load_index().entries) == ["2", "6", "7", "8", "9"]
+
+
+def test_prune_in_batches(store: ResponseCache) -> None:
+    for i in range(10):
+        store.write(str(i), response(bytes(100)))
+    size = store._load_index().entries["0"].size
+
+    assert store.prune(size * 5, size * 2, 3)
+    assert store.prune(size * 5, size * 2, 3)  # under high mark, continues
+    assert not store.prune(size * 5, size * 2, 3)
+    assert store._total_size() == size * 2
+
+
+def test_total_size_tracked(store: ResponseCache) -> None:
+    store.write("a", response(bytes(100)))
+    store.write("b", response(bytes(100)))
+    size = store._total_size()
+    store.write("a", response(bytes(100)))  # replaced, counted once
+    store.expire_in(["a"], 60)
+    assert store._total_size() == size
+    store.remove(["a"])
+    assert store._total_size() == size // 2
+    assert ResponseCache(store.path)._total_size() == size // 2
+
+
+def test_prune_reloads_index_changed_elsewhere(store: ResponseCache) -> None:
+    store.write("a", response(bytes(100)))
+    size = store._total_size()
+    assert not store.prune(size * 2, size, 10)
+
+    other = ResponseCache(store.path)
+    for key in "bcd":
+        other.write(key, response(bytes(100)))
+    assert not store.prune(size * 3, size * 2, 10)
+    assert store._index
+    assert sorted(store._index.entries) == ["c", "d"]
+    assert store._total_size() == size * 2
+
+
+def test_memory_cache_evicts_least_recent() -> None:
+    mem = MemoryCache[str, int](max_size=3)
+    for i, key in enumerate("abc"):
+        mem.put(key, i)
+    assert mem.get("a") == 0
+    mem.put("d", 3)
+    assert mem.get("b") is None
+    assert (mem.size, mem.evictions, mem.hits, mem.misses) == (3, 1, 1, 1)
+
+
+def test_memory_cache_sizes() -> None:
+    mem = MemoryCache[str, str](max_size=10)
+    mem.put("a", "a", size=6)
+    mem.put("b", "b", size=6)
+    assert mem.get("a") is None
+    mem.put("c", "c", size=11)  # larger than the whole budget, not kept
+    assert mem.get("b") == "b"
+    assert len(mem) == 1
+
+
+def test_memory_cache_expiration() -> None:
+    now = datetime.now(UTC).timestamp()
+    mem = MemoryCache[str, int](max_size=10)
+    mem.put("a", 1, expire=now - 1)
+    mem.put("b", 2, expire=now - 1)
+    mem.put("c", 3, expire=now + 60)
+    assert mem.get("a") is None
+    assert mem.pop("c") == 3
+    assert mem.prune_expired() == 1
+    assert (len(mem), mem.size, mem.expirations) == (0, 0, 2)
+
+
+@pytest.mark.parametrize(("headers", "ttl"), [
+    ({}, None),
+    ({"Cache-Control": "public, max-age=600"}, 600),
+    ({"cache-control": 'max-age="60"'}, 60),
+    ({"Cache-Control": "max-age=600, no-cache"}, 0),
+    ({"Cache-Control": "no-store"}, 0),
+    ({"Cache-Control": "max-age=-5"}, 0),
+    ({"Cache-Control": "max-age=x", "Expires": "0"}, 0),
+    ({"Expires": "Thu, 01 Jan 1970 00:00:00 GMT"}, 0),
+])
+def test_upstream_ttl(headers: dict[str, str], ttl: float | None) -> None:
+    assert upstream_ttl(headers) == ttl
+
+
+def test_upstream_ttl_from_expires() -> None:
+    date = datetime.now(UTC) + timedelta(hours=1)
+    ttl = upstream_ttl({"Expires": format_datetime(date, usegmt=True)})
+    assert ttl is not None
+    assert 3590 < ttl <= 3600
+
+
+def test_policy_rules() -> None:
+    policy = CachePolicy()
+    player = "https://www.youtube.com/s/player/abc/base.js"
+    assert policy.rule_ttl(player, {}) == 60 * 60 * 24 * 7
+    assert policy.rule_ttl(player, {"Cache-Control": "max-age=60"}) == 60
+    assert policy.rule_ttl(player, {"Cache-Control": "max-age=9999999"}) \
+        == 60 * 60 * 24 * 30
+    assert policy.rule_ttl("https://www.youtube.com/watch", {}) is None
+
+
+def test_policy_load(tmp_path: Path) -> None:
+    path = tmp_path / "policy.json"
+    path.write_text(json.dumps({
+        "default": 10,
+        "kinds": {"channel": 20},
+        "rules": [{"url": "/s/player/", "ttl": 30}],
+    }))
+    policy = CachePolicy.load(path)
+
+    assert policy.kind_ttl("channel") == 20
+    assert policy.kind_ttl("search") == 60 * 15
+    assert policy.kind_ttl("video") == 10
+    assert policy.rule_ttl("https://youtube.com/s/player/a.js", {}) == 30
+    assert len(policy.rules) == 2
+
+
+def innertube_body(visitor: str, **extra: object) -> bytes:
+    return json.dumps({
+        "context": {
+            "client": {"clientName": "WEB", "visitorData": visitor},
+            "clickTracking": {"clickTrackingParams": visitor},
+        },
+        "browseId": "UC123",
+        **extra,
+    }).encode()
+
+
+def test_normalize_body_drops_volatile_fields() -> None:
+    body = json.loads(normalize_body(BROWSE, innertube_body("a")))
+    assert body == {"context": {"client": {"clientName": "WEB"}},
+                    "browseId": "UC123"}
+    assert normalize_body(BROWSE, innertube_body("a")) == \
+        normalize_body(BROWSE, innertube_body("b"))
+    assert normalize_body(BROWSE, innertube_body("a")) != \
+        normalize_body(BROWSE, innertube_body("a", params="x"))
+
+
+def test_normalize_body_by_endpoint() -> None:
+    body = json.dumps({"clickTracking": 1, "query": "q"}).encode()
+    assert json.loads(normalize_body(BROWSE, body)) == {"query": "q"}
+    player = BROWSE.replace("browse", "player")
+    assert json.loads(normalize_body(player, body)) == json.loads(body)
+
+
+@pytest.mark.parametrize(("url", "data"), [
+    ("https://www.youtube.com/watch?v=x", b'{"b": 1, "a": 2}'),
+    (BROWSE, b"not json"),
+    (BROWSE, b"[1, 2]"),
+    (BROWSE, b""),
+])
+def test_normalize_body_leaves_others(url: str, data: bytes) -> None:
+    assert normalize_body(url, data) == data
+
+
+def test_key_normalization() -> None:
+    def key(visitor: str, normalize: bool = True) -> str | None:
+        request = YtdlpRequest(BROWSE, data=innertube_body(visitor))
+        return ResponseCache.key(request, normalize)
+
+    assert key("a") == key("b")
+    assert key("a", normalize=False) != key("b", normalize=False)
@@ -0,0 +1,129 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import json
+import sqlite3
+from typing import TYPE_CHECKING
+
+import pytest
+
+from insidious.extractors.cache import CachedResponse, ResponseCache
+from insidious.extractors.codecs import (
+    Codec,
+    Codecs,
+    CodecUnavailable,
+    LZ4Codec,
+    ZstdCodec,
+)
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from pathlib import Path
+
+SAMPLES = [
+    json.dumps({
+        "videoId": f"video{i:06}",
+        "title": f"Some video number {i}",
+        "viewCount": str(i * 1234),
+        "thumbnails": [{"url": f"https://i.ytimg.com/vi/{i}/hq.jpg"}],
+    }).encode()
+    for i in range(2000)
+]
+
+
+@pytest.fixture
+def zstd() -> None:
+    pytest.importorskip("zstandard")
+
+
+@pytest.fixture(autouse=True)
+def restore_codecs() -> Iterator[None]:
+    known, default = Codecs.known, Codecs.default
+    yield
+    Codecs.known, Codecs.default = known, default
+
+
+def round_trip(codec: Codec) -> None:
+    for sample in (b"", *SAMPLES[:10]):
+        assert codec.decompress(codec.compress(sample)) == sample
+
+
+def test_lz4_round_trip() -> None:
+    round_trip(LZ4Codec())
+
+
+@pytest.mark.usefixtures("zstd")
+def test_zstd_round_trip() -> None:
+    round_trip(ZstdCodec())
+
+
+@pytest.mark.usefixtures("zstd")
+def test_trained_zstd_round_trip(tmp_path: Path) -> None:
+    trained = ZstdCodec.train(SAMPLES, tmp_path)
+    round_trip(trained)
+    assert trained.name.startswith("zstd-")
+
+    loaded = ZstdCodec.from_dicts(tmp_path)
+    assert [codec.name for codec in loaded] == [trained.name]
+    assert loaded[0].decompress(trained.compress(SAMPLES[0])) == SAMPLES[0]
+
+    with pytest.raises(RuntimeError):
+        ZstdCodec().decompress(trained.compress(SAMPLES[0]))
+
+
+@pytest.mark.usefixtures("zstd")
+def test_setup_prefers_codec(tmp_path: Path) -> None:
+    Codecs.setup("zstd", tmp_path)
+    assert Codecs.default.name == "zstd"
+    Codecs.setup("unknown", tmp_path)
+    assert Codecs.default.name == "lz4"
+
+    with pytest.raises(CodecUnavailable):
+        Codecs.get("zstd-123")
+
+
+@pytest.mark.usefixtures("zstd")
+def test_responses_keep_their_codec(tmp_path: Path) -> None:
+    store = ResponseCache(tmp_path / "responses.sqlite3")
+    response = CachedResponse("https://a", {}, 200, "OK", SAMPLES[0], 2**40)
+
+    Codecs.setup("zstd", tmp_path)
+    store.write("a", response)
+    Codecs.setup("lz4", tmp_path)
+    store.write("b", response)
+
+    assert store.response("a") == store.response("b") == response
+
+
+def test_old_table_migrated(tmp_path: Path) -> None:
+    path = tmp_path / "responses.sqlite3"
+    with sqlite3.connect(path) as db:
+        db.execute("""
+            CREATE TABLE responses (
+                key TEXT PRIMARY KEY,
+                access REAL NOT NULL,
+                expire REAL NOT NULL,
+                size INTEGER NOT NULL,
+                url TEXT NOT NULL,
+                headers TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                reason TEXT NOT NULL,
+                data BLOB NOT NULL
+            )
+        """)
+        db.execute(
+            "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ("old", 0, 2**40, 1, "https://a", "{}", 200, "OK",
+             LZ4Codec().compress(b"old")),
+        )
+    db.close()
+
+    store = ResponseCache(path)
+    assert (old := store.response("old"))
+    assert old.data == b"old"
+
+    new = CachedResponse("https://b", {}, 200, "OK", b"new", 2**40)
+    store.write("new", new)
+    assert store.response("new") == new
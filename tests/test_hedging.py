@@ -0,0 +1,138 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import asyncio
+from collections import deque
+from typing import TYPE_CHECKING, ClassVar, cast
+
+import pytest
+
+from insidious.extractors.data import Video
+from insidious.extractors.hedging import HedgedClient, LatencyTracker
+from insidious.extractors.invidious import InvidiousClient
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+
+    from insidious.extractors.ytdlp import YtdlpClient
+
+THRESHOLD = 0.05
+FIELDS = {"title", "duration"}
+
+
+class FakeClient:
+    """Answers after a delay, with a video titled after the client."""
+
+    video_fields: ClassVar[frozenset[str]] = InvidiousClient.video_fields
+
+    def __init__(
+        self, name: str, delay: float, error: Exception | None = None,
+    ) -> None:
+        super().__init__()
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.started = 0
+        self.finished = 0
+
+    async def video(
+        self, id: str, fields: Collection[str] | None = None,  # noqa: ARG002
+    ) -> Video:
+        self.started += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.finished += 1
+        return Video.model_construct(id=id, title=self.name)
+
+
+def hedged(primary: FakeClient, backup: FakeClient) -> HedgedClient:
+    return HedgedClient(
+        cast("YtdlpClient", primary),
+        cast("InvidiousClient", backup),
+        enabled=True,
+        latency=LatencyTracker(deque(), default=THRESHOLD),
+    )
+
+
+def test_threshold_from_samples() -> None:
+    latency = LatencyTracker(deque([1.0] * 10), min_samples=32, default=3)
+    assert latency.threshold == 3
+    latency.samples.extend(float(i) for i in range(1, 101))
+    assert 90 < latency.threshold < 100
+    latency.samples = deque([0.1] * 50)
+    assert latency.threshold == latency.floor
+
+
+def test_fast_primary_not_hedged() -> None:
+    primary, backup = FakeClient("yt-dlp", 0), FakeClient("invidious", 0)
+    video = asyncio.run(hedged(primary, backup).video("a", FIELDS))
+    assert video.title == "yt-dlp"
+    assert backup.started == 0
+
+
+def test_backup_after_threshold_wins() -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 4)
+    backup = FakeClient("invidious", 0)
+
+    async def main() -> None:
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        video = await hedged(primary, backup).video("a", FIELDS)
+        assert video.title == "invidious"
+        assert loop.time() - start >= THRESHOLD
+        assert backup.started == 1
+
+        # The losing extraction goes on, to be cached for later
+        assert primary.finished == 0
+        await asyncio.gather(*HedgedClient._background)
+        assert primary.finished == 1
+
+    asyncio.run(main())
+
+
+def test_primary_wins_after_hedging() -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 2)
+    backup = FakeClient("invidious", THRESHOLD * 10)
+
+    async def main() -> None:
+        video = await hedged(primary, backup).video("a", FIELDS)
+        assert video.title == "yt-dlp"
+        assert (backup.started, backup.finished) == (1, 0)
+
+    asyncio.run(main())
+
+
+def test_failing_backup_falls_back_to_primary() -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 2)
+    backup = FakeClient("invidious", 0, ValueError("down"))
+    video = asyncio.run(hedged(primary, backup).video("a", FIELDS))
+    assert video.title == "yt-dlp"
+    assert backup.started == 1
+
+
+def test_primary_error_raised_when_both_fail() -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 2, LookupError("private"))
+    backup = FakeClient("invidious", 0, ValueError("down"))
+    with pytest.raises(LookupError):
+        asyncio.run(hedged(primary, backup).video("a", FIELDS))
+
+
+@pytest.mark.parametrize("fields", [None, {"title", "formats"}])
+def test_fields_invidious_lacks_not_hedged(fields: set[str] | None) -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 2)
+    backup = FakeClient("invidious", 0)
+    video = asyncio.run(hedged(primary, backup).video("a", fields))
+    assert video.title == "yt-dlp"
+    assert backup.started == 0
+
+
+def test_disabled_not_hedged() -> None:
+    primary = FakeClient("yt-dlp", THRESHOLD * 2)
+    backup = FakeClient("invidious", 0)
+    client = hedged(primary, backup)
+    client.enabled = False
+    assert asyncio.run(client.video("a", FIELDS)).title == "yt-dlp"
+    assert backup.started == 0
@@ -0,0 +1,183 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import asyncio
+import json
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from insidious.extractors.client import APIInstance
+from insidious.extractors.data import (
+    ChannelEntry,
+    LiveStatus,
+    PlaylistEntry,
+    VideoEntry,
+)
+from insidious.extractors.filters import Date, Features, SearchFilter, Type
+from insidious.extractors.invidious import InvidiousClient
+
+DATA = Path(__file__).parent / "data" / "invidious"
+INSTANCE = "https://inv.example"
+CLIENT = InvidiousClient()
+
+
+class FakeAPI:
+    """Answers with recorded responses, named after the requested path."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.requests: list[tuple[str, dict[str, Any] | None]] = []
+
+    async def __call__(
+        self, path: str, params: dict[str, Any] | None = None,
+    ) -> tuple[APIInstance, Any]:
+        self.requests.append((path, params))
+        await asyncio.sleep(0)
+        name = path.strip("/").split("/")[0].removesuffix("s")
+        data = json.loads((DATA / f"{name}.json").read_text())
+        return (APIInstance(INSTANCE + "/api/v1"), data)
+
+
+@pytest.fixture
+def api(monkeypatch: pytest.MonkeyPatch) -> FakeAPI:
+    fake = FakeAPI()
+    monkeypatch.setattr(InvidiousClient, "_get", fake)
+    return fake
+
+
+def test_video(api: FakeAPI) -> None:
+    video = asyncio.run(CLIENT.video("aqz-KE-bpKQ"))
+    assert api.requests == [("/videos/aqz-KE-bpKQ", None)]
+
+    assert (video.id, video.title) == ("aqz-KE-bpKQ", "Big Buck Bunny")
+    assert video.url == "https://www.youtube.com/watch?v=aqz-KE-bpKQ"
+    assert (video.duration, video.views, video.likes) == \
+        (635, 21876543, 123456)
+    assert video.upload_date == datetime.fromtimestamp(1415916000, UTC)
+    assert video.live_status is None
+    assert video.channel_name == "Blender"
+    assert video.channel_url == \
+        "https://www.youtube.com/channel/UCSMOQeBJ2RAnuFungnQOxLg"
+    assert [t.url for t in video.thumbnails] == [
+        f"{INSTANCE}/vi/aqz-KE-bpKQ/maxres.jpg",
+        "https://i.ytimg.com/vi/aqz-KE-bpKQ/mqdefault.jpg",
+    ]
+
+
+@pytest.mark.usefixtures("api")
+def test_video_formats() -> None:
+    video = asyncio.run(CLIENT.video("aqz-KE-bpKQ"))
+    formats = {f.id: f for f in video.formats}
+    assert set(formats) == {"18", "140", "137", "sb0", "sb1"}  # no URL: 999
+
+    muxed = formats["18"]
+    assert (muxed.vcodec, muxed.acodec) == ("avc1.42001E", "mp4a.40.2")
+    assert (muxed.width, muxed.height, muxed.name) == (640, 360, "360p")
+
+    audio = formats["140"]
+    assert (audio.vcodec, audio.acodec) == (None, "mp4a.40.2")
+    assert (audio.container, audio.filesize, audio.audio_channels) == \
+        ("m4a", 10280311, 2)
+    assert audio.average_bitrate == pytest.approx(130.876)
+
+    video_only = formats["137"]
+    assert (video_only.vcodec, video_only.acodec) == ("avc1.640028", None)
+    assert (video_only.width, video_only.height, video_only.fps) == \
+        (1920, 1080, 24)
+    assert video_only.url.startswith(f"{INSTANCE}/videoplayback?")
+    assert video.streams_expire == datetime.fromtimestamp(1700000000, UTC)
+
+
+@pytest.mark.usefixtures("api")
+def test_video_storyboards() -> None:
+    video = asyncio.run(CLIENT.video("aqz-KE-bpKQ"))
+    board = next(f for f in video.formats if f.id == "sb1")
+    assert (board.name, board.protocol) == ("storyboard", "mhtml")
+    assert (board.width, board.height, board.columns, board.rows) == \
+        (160, 90, 5, 5)
+
+    # 318 thumbnails of 2s, 25 per sheet
+    assert len(board.fragments) == 13
+    assert board.fragments[0].url == \
+        f"{INSTANCE}/sb/aqz-KE-bpKQ/storyboard3_L2/M0.jpg?sqp=abc&sigh=rs"
+    assert board.fragments[12].url == \
+        f"{INSTANCE}/sb/aqz-KE-bpKQ/storyboard3_L2/M12.jpg?sqp=abc&sigh=rs"
+    assert [f.duration for f in board.fragments[-2:]] == [50, 36]
+
+    # The largest storyboard is the one used
+    vtt = video.webvtt_storyboard.splitlines()
+    assert vtt[0] == "WEBVTT"
+    assert len(vtt) == 1 + 318 * 2
+    assert vtt[1] == "00:00:00.000 --> 00:00:02.000"
+    assert "storyboard3_L2/M0.jpg" in vtt[2]
+    assert vtt[2].endswith("#xywh=0,0,160,90")
+    assert vtt[4].endswith("#xywh=160,0,160,90")
+
+
+@pytest.mark.usefixtures("api")
+def test_video_captions() -> None:
+    video = asyncio.run(CLIENT.video("aqz-KE-bpKQ"))
+    assert video.subtitles
+    assert set(video.subtitles) == {"en", "fr"}
+    english = video.subtitles["en"][0]
+    assert (english.extension, english.name) == ("vtt", "English")
+    assert english.url == \
+        f"{INSTANCE}/api/v1/captions/aqz-KE-bpKQ?label=English"
+
+
+def test_search(api: FakeAPI) -> None:
+    search_filter = SearchFilter(
+        date=Date.ThisWeek, type=Type.Video,
+        features=Features.HD | Features.Subtitles,
+    )
+    search = asyncio.run(CLIENT.search("big buck", search_filter, page=2))
+    assert api.requests == [("/search", {
+        "q": "big buck", "page": 2, "sort": "relevance", "date": "week",
+        "type": "video", "features": "hd,subtitles",
+    })]
+    assert search.url == \
+        "https://www.youtube.com/results?search_query=big+buck"
+    assert search.title == "big buck"
+
+    video, live, channel, playlist = search.entries  # no hashtag
+    assert isinstance(video, VideoEntry)
+    assert (video.id, video.duration, video.views) == \
+        ("aqz-KE-bpKQ", 635, 21876543)
+    assert isinstance(live, VideoEntry)
+    assert live.live_status == LiveStatus.is_live
+    assert live.live_release_date is None
+
+    assert isinstance(channel, ChannelEntry)
+    assert (channel.id, channel.uploader, channel.followers) == \
+        ("UCSMOQeBJ2RAnuFungnQOxLg", "Blender", 1900000)
+    assert channel.best_thumbnail.url == "//yt3.ggpht.com/blender=s176"
+
+    assert isinstance(playlist, PlaylistEntry)
+    assert playlist.url == \
+        "https://www.youtube.com/playlist?list=PLa1F2ddGya_8V90Kd5eC5PeBjySbXWGK1"
+    assert [t.url for t in playlist.thumbnails] == \
+        [f"{INSTANCE}/vi/aqz-KE-bpKQ/mqdefault.jpg"]
+
+
+def test_playlist(api: FakeAPI) -> None:
+    id = "PLa1F2ddGya_8V90Kd5eC5PeBjySbXWGK1"
+    playlist = asyncio.run(CLIENT.playlist(id, page=3))
+    assert api.requests == [(f"/playlists/{id}", {"page": 3})]
+
+    assert (playlist.id, playlist.title) == (id, "Blender Open Movies")
+    assert (playlist.views, playlist.total_entries) == (98765, 14)
+    assert playlist.last_change == datetime(2023, 11, 15)
+    assert playlist.channel_name == "Blender"
+    assert [(e.id, e.nth) for e in playlist] == \
+        [("aqz-KE-bpKQ", 1), ("eRsGyueVLvQ", 2)]
+
+    # Like yt-dlp's entries, which link to their position in the playlist
+    assert playlist[0].url == \
+        f"https://www.youtube.com/watch?v=aqz-KE-bpKQ&list={id}"
+    assert playlist[1].url == \
+        f"https://www.youtube.com/watch?v=eRsGyueVLvQ&list={id}&index=2"
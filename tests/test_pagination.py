@@ -0,0 +1,291 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import asyncio
+import pickle  # noqa: S403
+from typing import TYPE_CHECKING, Any
+from uuid import uuid4
+
+import pytest
+from starlette.datastructures import QueryParams
+from starlette.requests import Request
+
+from insidious.extractors.data import Playlist, VideoEntry
+from insidious.pagination import (
+    CompactEntry,
+    MemoryPaginationStore,
+    Pagination,
+    PlaylistIndex,
+    Prefetcher,
+    SQLitePaginationStore,
+)
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+PAGES = 6
+
+
+def request(query: str = "") -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/results",
+        "query_string": query.encode(),
+        "headers": [],
+        "server": ("localhost", 80),
+        "scheme": "http",
+        "root_path": "",
+    })
+
+
+def fetch(page: int, page_size: int) -> list[str]:
+    if page > PAGES:
+        return []
+    return [f"{page}-{i}" for i in range(page_size)]
+
+
+def browse(page_size: int, per_page: int, drop_every: int) -> list[str]:
+    """Go through all pages, the pagination dropped every few requests."""
+    query, shown, requests = f"per_page={per_page}", [], 0
+
+    async def next_page() -> Pagination[Any]:
+        pagination = (await Pagination.get(request(query))).advance()
+        while pagination.running_short:
+            pagination.add(fetch(pagination.page, page_size))
+        return pagination
+
+    while True:
+        pagination = asyncio.run(next_page())
+        shown += pagination.items
+        requests += 1
+        if not (url := pagination.next_url):
+            return shown
+
+        if requests % drop_every:
+            pagination.save()
+        else:
+            Pagination.store.drop(pagination.id)
+        query = url.query
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(
+    request: pytest.FixtureRequest,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    store = MemoryPaginationStore() if request.param == "memory" else \
+        SQLitePaginationStore(tmp_path / "paginations.sqlite3")
+    monkeypatch.setattr(Pagination, "store", store)
+
+
+@pytest.mark.usefixtures("store")
+@pytest.mark.parametrize("page_size", [5, 12, 30])
+@pytest.mark.parametrize("per_page", [3, 12, 25])
+@pytest.mark.parametrize("drop_every", [1, 2, 3, 1000])
+def test_resumed_paginations_show_everything_once(
+    page_size: int, per_page: int, drop_every: int,
+) -> None:
+    expected = [
+        x for page in range(1, PAGES + 1) for x in fetch(page, page_size)
+    ]
+    assert browse(page_size, per_page, drop_every) == expected
+
+
+def test_next_url_position() -> None:
+    query = "per_page=4&page=3&skip=1"
+    pagination = Pagination(request(query), uuid4(), 3, 4, skip=1)
+    for page in (3, 4, 5):
+        pagination.add(fetch(page, 3))
+    assert pagination.items == ["3-1", "3-2", "4-0", "4-1"]
+
+    # The next item is the 3rd of page 4, but the last page added is 5
+    url = pagination.next_url
+    assert url
+    params = QueryParams(url.query)
+    assert (params["page"], params["skip"]) == ("4", "2")
+
+    # Nothing left after this one, the next page is a new one
+    pagination.advance()
+    url = pagination.next_url
+    assert url
+    params = QueryParams(url.query)
+    assert params["page"] == "6"
+    assert "skip" not in params
+
+
+def video_entry(i: int) -> VideoEntry:
+    return VideoEntry.model_validate({
+        "entry_type": "VideoEntry",
+        "id": f"video{i:06}",
+        "url": f"https://www.youtube.com/watch?v=video{i:06}",
+        "title": f"Video {i}",
+        "description": "Not shown in lists",
+        "duration": 300 + i,
+        "view_count": 1000 + i,
+        "channel": "Channel",
+        "channel_id": "UC" + "x" * 22,
+        "channel_url": "https://www.youtube.com/channel/UC" + "x" * 22,
+        "uploader_id": "@channel",
+        "live_status": "not_live",
+        "timestamp": 1_700_000_000 + i,
+        "thumbnails": [
+            {"url": f"https://i.ytimg.com/vi/{i}/{w}.jpg", "width": w,
+             "height": w // 2}
+            for w in (168, 336)
+        ],
+    })
+
+
+def test_compact_entry_round_trip() -> None:
+    entry = video_entry(1)
+    compact = CompactEntry.pack(entry)
+    unpacked = compact.unpack()
+
+    assert type(unpacked) is VideoEntry
+    for name in ("id", "url", "title", "duration", "views", "release_date",
+                 "channel_name", "live_status", "thumbnails_srcset",
+                 "shortest_channel_url"):
+        assert getattr(unpacked, name) == getattr(entry, name)
+    assert pickle.loads(pickle.dumps(compact)).unpack() == unpacked  # noqa: S301
+
+
+def test_compact_entry_drops_unrendered_fields() -> None:
+    unpacked = CompactEntry.pack(video_entry(1)).unpack()
+    assert "description" not in unpacked.model_fields_set
+    assert "channel_id" not in unpacked.model_fields_set
+    assert all(
+        "height" not in thumbnail.model_fields_set
+        for thumbnail in unpacked.thumbnails
+    )
+
+
+def test_pagination_finds_packed_entries() -> None:
+    query = "find_attr=id:video000007"
+    pagination = asyncio.run(Pagination.get(request(query)))
+    pagination.add([video_entry(i) for i in range(20)])
+
+    assert pagination.found_item
+    assert pagination.found_item.id == "video000007"
+    assert [e.id for e in pagination.items] == \
+        [f"video{i:06}" for i in range(12)]
+    assert isinstance(pagination._data[-1], CompactEntry)
+
+
+def test_prefetcher_queues_next_page_once() -> None:
+    fetched: list[int] = []
+
+    async def fetcher(page: int) -> list[str]:
+        fetched.append(page)
+        await asyncio.sleep(0)
+        return fetch(page, 3)
+
+    async def main() -> None:
+        prefetcher = Prefetcher(concurrency=2)
+        pagination = Pagination(request(), uuid4(), 1, 4, fetcher=fetcher)
+        prefetcher.prefetch(pagination)
+        prefetcher.prefetch(pagination)  # already queued
+        assert await prefetcher.fetch(pagination) == fetch(1, 3)
+        assert fetched == [1]
+        assert (prefetcher.started, prefetcher.used) == (1, 1)
+
+        # Taken by the request it was for, the next one fetches it again
+        assert await prefetcher.fetch(pagination) == fetch(1, 3)
+        assert fetched == [1, 1]
+        assert prefetcher.used == 1
+
+    asyncio.run(main())
+
+
+def test_prefetcher_skips_paginations_with_enough_items() -> None:
+    async def fetcher(page: int) -> list[str]:
+        await asyncio.sleep(0)
+        return fetch(page, 3)
+
+    async def main() -> None:
+        prefetcher = Prefetcher(concurrency=2)
+        pagination = Pagination(request(), uuid4(), 1, 4, fetcher=fetcher)
+        pagination.add(fetch(1, 3)).add(fetch(2, 3))
+        prefetcher.prefetch(pagination)
+        assert prefetcher.started == 0
+
+        disabled = Prefetcher(concurrency=0)
+        disabled.prefetch(pagination.advance())
+        assert disabled.started == 0
+        prefetcher.prefetch(pagination)
+        assert prefetcher.started == 1
+        assert await prefetcher.fetch(pagination) == fetch(3, 3)
+
+    asyncio.run(main())
+
+
+def test_current_page_unpacked_once() -> None:
+    pagination = Pagination(request(), uuid4(), 1, 4)
+    pagination.add([video_entry(i) for i in range(6)])
+    items = pagination.items
+    assert pagination.items is items
+    assert [e.id for e in items] == [f"video{i:06}" for i in range(4)]
+
+    assert [e.id for e in pagination.advance().items] == \
+        ["video000004", "video000005"]
+    pagination.add([video_entry(6)])
+    assert len(pagination.items) == 3
+    assert "_items" not in pagination.state
+
+
+@pytest.fixture
+def index(tmp_path: Path) -> PlaylistIndex:
+    index = PlaylistIndex(tmp_path / "playlist_pages.sqlite3")
+    for page in (1, 2, 3):
+        entries = [video_entry(page * 10 + i) for i in range(3)]
+        index.learn(Playlist.model_construct(id="PL", entries=entries), page)
+    return index
+
+
+def finding(video_id: str) -> Pagination[Any]:
+    return Pagination(request(), uuid4(), 1, find_attr=("id", video_id))
+
+
+def test_playlist_index_seek(index: PlaylistIndex) -> None:
+    pagination = finding("video000031")
+    assert index.seek(pagination, "PL")
+    assert pagination.page == 3
+    assert index.jumps == 1
+
+    assert not index.seek(finding("video000031"), "PL2")
+    assert not index.seek(finding("unknown"), "PL")
+    assert not index.seek(pagination, "PL")  # not a new pagination anymore
+    assert not index.seek(Pagination(request(), uuid4(), 1), "PL")
+    assert index.jumps == 1
+
+
+def test_playlist_index_forget(index: PlaylistIndex) -> None:
+    assert index.page("PL", "video000021") == 2
+    index.forget("PL", "video000021")
+    assert index.page("PL", "video000021") is None
+    assert index.page("PL", "video000022") == 2
+    assert not index.seek(finding("video000021"), "PL")
+    assert index.misses == 1
+
+
+def test_pagination_reset_after_wrong_seek(index: PlaylistIndex) -> None:
+    pagination = finding("video000001")
+    index.learn(
+        Playlist.model_construct(id="PL", entries=[video_entry(1)]), 3,
+    )
+    assert index.seek(pagination, "PL")
+    pagination.add([video_entry(i) for i in range(30, 33)])
+    assert pagination.finding
+
+    pagination.reset()
+    assert (pagination.page, pagination.items) == (1, [])
+    assert not pagination.done
+    pagination.add([video_entry(i) for i in range(3)])
+    assert pagination.found_item
+    assert pagination.found_item.id == "video000001"
+    url = pagination.next_url
+    assert url
+    assert QueryParams(url.query)["page"] == "2"
@@ -0,0 +1,76 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import pytest
+
+from insidious import resolver as resolver_module
+from insidious.resolver import PathKind, PathResolver
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+
+@pytest.fixture
+def db(tmp_path: Path) -> Path:
+    return tmp_path / "paths.sqlite3"
+
+
+def test_learn_and_forget(db: Path) -> None:
+    resolver = PathResolver(db)
+    assert resolver.get("@someone") is None
+
+    resolver.learn("@someone", PathKind.channel)
+    resolver.learn("abcdefghijk", PathKind.video)
+    assert resolver.get("@someone") == PathKind.channel
+    assert resolver.get("abcdefghijk") == PathKind.video
+
+    resolver.forget("@someone")
+    assert resolver.get("@someone") is None
+    assert PathResolver(db).get("@someone") is None
+
+
+def test_kinds_persisted(db: Path) -> None:
+    PathResolver(db).learn("@someone", PathKind.channel)
+    assert PathResolver(db).get("@someone") == PathKind.channel
+
+
+def test_kinds_shared_between_processes(db: Path) -> None:
+    first, second = PathResolver(db), PathResolver(db)
+    first.learn("@someone", PathKind.channel)
+    assert second.get("@someone") == PathKind.channel
+
+
+def test_kinds_expire(db: Path) -> None:
+    resolver = PathResolver(db, ttl=60, none_ttl=0)
+    resolver.learn("nothing", PathKind.none)
+    resolver.learn("@someone", PathKind.channel)
+    assert resolver.get("nothing") is None
+    assert resolver.get("@someone") == PathKind.channel
+
+    assert PathResolver(db, ttl=0).get("@someone") is None
+
+
+def test_kinds_pruned(db: Path) -> None:
+    resolver = PathResolver(db, ttl=60, none_ttl=60)
+    resolver.learn("nothing", PathKind.none)
+    resolver.learn("@someone", PathKind.channel)
+
+    resolver.none_ttl = 0
+    resolver.prune()
+    assert PathResolver(db, ttl=60, none_ttl=60).get("nothing") is None
+    assert resolver.get("@someone") == PathKind.channel
+
+
+def test_kinds_in_memory_bounded(
+    db: Path, monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setattr(resolver_module, "PATH_KIND_ENTRIES", 2)
+    resolver = PathResolver(db)
+    for path in ("a", "b", "c"):
+        resolver.learn(path, PathKind.video)
+    assert len(resolver._kinds) == 2
+    assert resolver.get("a") == PathKind.video  # from the database
@@ -0,0 +1,457 @@
+# Copyright Insidious authors <https://github.com/xrun1/insidious>
+# SPDX-License-Identifier: AGPL-3.0-or-later
+
+from __future__ import annotations
+
+import asyncio
+import io
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any
+
+import pytest
+import yt_dlp
+from typing_extensions import override
+from yt_dlp.networking.common import (
+    Request as YtdlpRequest,
+    Response as YtdlpResponse,
+)
+from yt_dlp.networking.exceptions import HTTPError
+from yt_dlp.utils import ExtractorError
+
+from insidious.extractors import ytdlp
+from insidious.extractors.data import Channel, ChannelNotFound
+from insidious.extractors.ytdlp import (
+    YTDLP,
+    CachedYoutubeDL,
+    EntriesCursor,
+    ExtractionCancelled,
+    InstanceRetired,
+    YoutubeDLPool,
+    YtdlpClient,
+    is_unavailable,
+)
+from insidious.net import PARALLEL_REQUESTS_PER_HOST, max_parallel_requests
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Iterator
+
+PATH = "playlist?list=PLtest"
+
+
+class FakeYoutubeDL:
+    """Gives entries page by page, making a request before each new one."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.callback: Callable[[Any], None] | None = None
+        self.retired = False
+        self.uses = 0
+        self.created = time.monotonic()
+        self.closed = False
+
+    @contextmanager
+    def before_requests(
+        self, callback: Callable[[Any], None],
+    ) -> Iterator[None]:
+        self.callback = callback
+        try:
+            yield
+        finally:
+            self.callback = None
+
+    def entries(self, pages: int, per_page: int) -> Iterator[dict[str, Any]]:
+        for page in range(1, pages + 1):
+            if page > 1 and self.callback:
+                self.callback(None)
+            for i in range(per_page):
+                yield {"url": f"https://www.youtube.com/watch?v={page}-{i}"}
+
+    def close(self) -> None:
+        self.closed = True
+
+
+def urls(data: dict[str, Any]) -> list[str]:
+    return [entry["url"].split("=")[-1] for entry in data["entries"]]
+
+
+def process(
+    ytdl: FakeYoutubeDL, data: dict[str, Any], page: int,
+    cursor: EntriesCursor | None = None,
+    page_done: Callable[[list[dict[str, Any]]], None] = lambda _: None,
+) -> dict[str, Any]:
+    return YTDLP._process_entries(
+        ytdl, PATH, data, page, cursor, page_done,  # type: ignore
+    )
+
+
+def next_cursor(page: int) -> EntriesCursor | None:
+    pending = YTDLP._cursors.pop((PATH, page))
+    assert pending
+    return pending.result(0)
+
+
+@pytest.fixture(autouse=True)
+def clear_cursors() -> Iterator[None]:
+    yield
+    for page in range(10):
+        YTDLP._cursors.pop((PATH, page))
+
+
+def test_cursor_resumes_next_page() -> None:
+    ytdl = FakeYoutubeDL()
+    data = {"title": "t", "entries": ytdl.entries(pages=3, per_page=2)}
+    done: list[list[str]] = []
+
+    first = process(
+        ytdl, data, 1, page_done=lambda e: done.append(urls({"entries": e})),
+    )
+    assert urls(first) == ["1-0", "1-1"]
+    assert [e["nth"] for e in first["entries"]] == [1, 2]
+    assert first["entries"][0]["entry_type"] == "VideoEntry"
+    assert done == [["1-0", "1-1"]]  # before the next page's first entry
+
+    cursor = next_cursor(2)
+    assert cursor
+    assert cursor.ytdl is ytdl
+    assert cursor.nth == 3
+    second = process(ytdl, cursor.data, 2, cursor)
+    assert urls(second) == ["2-0", "2-1"]
+    assert [e["nth"] for e in second["entries"]] == [3, 4]
+
+    cursor = next_cursor(3)
+    assert cursor
+    assert urls(process(ytdl, cursor.data, 3, cursor)) == ["3-0", "3-1"]
+
+    cursor = next_cursor(4)
+    assert cursor
+    assert cursor.first is None
+    assert urls(process(ytdl, cursor.data, 4, cursor)) == []
+
+
+def test_page_without_cursor_starts_over() -> None:
+    ytdl = FakeYoutubeDL()
+    data = {"entries": ytdl.entries(pages=3, per_page=2)}
+    third = process(ytdl, data, 3)
+    assert urls(third) == ["3-0", "3-1"]
+    assert [e["nth"] for e in third["entries"]] == [5, 6]
+
+
+@pytest.fixture
+def pool(monkeypatch: pytest.MonkeyPatch) -> YoutubeDLPool:
+    def create(_: YoutubeDLPool) -> FakeYoutubeDL:
+        return FakeYoutubeDL()
+
+    monkeypatch.setattr(YoutubeDLPool, "_create", create)
+    return YoutubeDLPool(2)
+
+
+def test_cursor_instance_waits_until_idle(pool: YoutubeDLPool) -> None:
+    with pool.checkout() as paused:
+        pass
+    order = []
+
+    def user() -> None:
+        with pool.checkout() as ytdl:
+            assert ytdl is paused
+            order.append("user")
+            time.sleep(0.1)
+
+    def resumer() -> None:
+        with pool.checkout(paused) as ytdl:
+            assert ytdl is paused
+            order.append("resumer")
+
+    threads = [threading.Thread(target=user), threading.Thread(target=resumer)]
+    threads[0].start()
+    time.sleep(0.02)
+    threads[1].start()
+    for thread in threads:
+        thread.join(5)
+    assert order == ["user", "resumer"]
+
+
+def test_cursor_instance_retired(pool: YoutubeDLPool) -> None:
+    pool.max_uses = 1
+    with pool.checkout() as paused:
+        pass
+    assert isinstance(paused, FakeYoutubeDL)
+    assert paused.retired
+    assert paused.closed
+    with pytest.raises(InstanceRetired), pool.checkout(paused):
+        pass
+
+
+def download_error(cause: Exception) -> yt_dlp.DownloadError:
+    return yt_dlp.DownloadError(str(cause), (type(cause), cause, None))
+
+
+def http_error(status: int) -> HTTPError:
+    response = YtdlpResponse(io.BytesIO(), "https://a", {}, status)
+    return HTTPError(response)
+
+
+@pytest.mark.parametrize(("error", "unavailable"), [
+    (ChannelNotFound(), True),
+    (ValueError(), False),
+    (yt_dlp.DownloadError("no cause"), False),
+    (download_error(ExtractorError("Video unavailable", expected=True)), True),
+    (download_error(ExtractorError("Private video", expected=True)), True),
+    (download_error(ExtractorError(
+        "This video has been removed by the uploader", expected=True,
+    )), True),
+    (download_error(ExtractorError(
+        "Sign in to confirm you're not a bot", expected=True,
+    )), False),
+    (download_error(ExtractorError(
+        "Video unavailable. This content isn't available, try again later",
+        expected=True,
+    )), False),
+    (download_error(ExtractorError("HTTP 404", cause=http_error(404))), True),
+    (download_error(ExtractorError("HTTP 429", cause=http_error(429))), False),
+])
+def test_is_unavailable(error: Exception, unavailable: bool) -> None:
+    assert is_unavailable(error) is unavailable
+
+
+class BlockingYoutubeDL(CachedYoutubeDL):
+    """Extracts forever, stopping only like real requests would."""
+
+    stopped = threading.Event()
+
+    @override
+    def extract_info(self, *_: Any, **__: Any) -> dict[str, Any]:
+        try:
+            while True:
+                if self._hooks.deadline:
+                    self._hooks.deadline.check()
+                time.sleep(0.01)
+        except ExtractionCancelled:
+            self.stopped.set()
+            raise
+
+
+@pytest.fixture
+def blocking_pool(monkeypatch: pytest.MonkeyPatch) -> YoutubeDLPool:
+    BlockingYoutubeDL.stopped.clear()
+
+    def create(_: YoutubeDLPool) -> BlockingYoutubeDL:
+        return BlockingYoutubeDL({"quiet": True})
+
+    monkeypatch.setattr(YoutubeDLPool, "_create", create)
+    pool = YoutubeDLPool(1)
+    monkeypatch.setattr(YtdlpClient, "_ytdls", pool)
+    return pool
+
+
+async def slots_released() -> bool:
+    semaphore = max_parallel_requests("https://youtube.com")
+    for _ in range(100):
+        if not YTDLP._slots and \
+                semaphore._value == PARALLEL_REQUESTS_PER_HOST:
+            return True
+        await asyncio.sleep(0.02)
+    return False
+
+
+@pytest.mark.parametrize("cancel", [False, True])
+def test_abandoned_extraction_frees_slot(
+    blocking_pool: YoutubeDLPool,
+    monkeypatch: pytest.MonkeyPatch,
+    cancel: bool,
+) -> None:
+    # Cancelled callers stop the extraction long before the deadline
+    monkeypatch.setattr(ytdlp, "EXTRACT_TIMEOUT", 10 if cancel else 0.2)
+
+    async def main() -> None:
+        extract = YTDLP._extract("watch?v=blocking", 1, False, True, False)
+        if cancel:
+            task = asyncio.create_task(extract)
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        else:
+            with pytest.raises(TimeoutError):
+                await extract
+
+        assert BlockingYoutubeDL.stopped.wait(1)
+        assert await slots_released()
+        assert len(blocking_pool._idle) == 1  # returned once stopped
+
+    asyncio.run(main())
+
+
+class PagedYoutubeDL(CachedYoutubeDL):
+    """Lists pages of entries, the 2nd one's first only once released."""
+
+    extractions = 0
+    release = threading.Event()
+
+    @override
+    def extract_info(self, *_: Any, **__: Any) -> dict[str, Any]:
+        PagedYoutubeDL.extractions += 1
+        return {"title": "t", "entries": self.entries()}
+
+    def entries(self) -> Iterator[dict[str, Any]]:
+        for page in range(1, 4):
+            if page > 1 and self._hooks.urlopen_callback:
+                self._hooks.urlopen_callback(YtdlpRequest("https://a"))
+            if page == 2:
+                self.release.wait(5)
+            for i in range(2):
+                yield {"url": f"https://www.youtube.com/watch?v={page}-{i}"}
+
+
+def test_next_page_waits_for_lookahead(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    PagedYoutubeDL.extractions = 0
+    PagedYoutubeDL.release.clear()
+
+    def create(_: YoutubeDLPool) -> PagedYoutubeDL:
+        return PagedYoutubeDL({"quiet": True})
+
+    monkeypatch.setattr(YoutubeDLPool, "_create", create)
+    monkeypatch.setattr(YtdlpClient, "_ytdls", YoutubeDLPool(2))
+
+    async def main() -> None:
+        first, _ = await YTDLP._extract(PATH, 1, False, False, False)
+        assert urls(first) == ["1-0", "1-1"]
+
+        # Requested while the lookahead still fetches its first entry
+        second = asyncio.create_task(
+            YTDLP._extract(PATH, 2, False, False, False),
+        )
+        await asyncio.sleep(0.1)
+        assert not second.done()
+        PagedYoutubeDL.release.set()
+
+        assert urls((await second)[0]) == ["2-0", "2-1"]
+        assert PagedYoutubeDL.extractions == 1
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("error", [TimeoutError(), yt_dlp.DownloadError("")])
+def test_failing_known_channel_tab_probed_again(
+    monkeypatch: pytest.MonkeyPatch, error: Exception,
+) -> None:
+    path = "@stale"
+    probed = Channel.model_construct(id="UC" + "x" * 22)
+    YTDLP._channel_tabs.put(path, "streams")
+
+    async def channel_tab(*_: Any) -> Channel:
+        await asyncio.sleep(0)
+        raise error
+
+    async def probe(*_: Any) -> Channel:
+        await asyncio.sleep(0)
+        return probed
+
+    monkeypatch.setattr(YTDLP, "_channel_tab", channel_tab)
+    monkeypatch.setattr(YTDLP, "_probe_channel_tabs", probe)
+    assert asyncio.run(YTDLP._channel(path, None, "", 1)) is probed
+    assert YTDLP._channel_tabs.get(path) is None
+
+
+class FakeExtraction:
+    """Stands in for extractions, finishing them once released."""
+
+    def __init__(self, error: Exception | None = None) -> None:
+        super().__init__()
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(
+        self, path: str, *_: Any,
+    ) -> tuple[dict[str, Any], Callable[[float], None]]:
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return ({"id": path}, lambda _: None)
+
+
+@pytest.fixture
+def extraction(monkeypatch: pytest.MonkeyPatch) -> FakeExtraction:
+    fake = FakeExtraction()
+    monkeypatch.setattr(YtdlpClient, "_extract", fake)
+    return fake
+
+
+def test_parallel_gets_share_extraction(extraction: FakeExtraction) -> None:
+    async def main() -> None:
+        gets = [asyncio.create_task(YTDLP._get("watch?v=a")) for _ in range(3)]
+        other = asyncio.create_task(YTDLP._get("watch?v=a", page=2))
+        await asyncio.sleep(0.01)
+        extraction.release.set()
+
+        results = await asyncio.gather(*gets)
+        assert all(data is results[0][0] for data, _ in results)
+        await other
+        assert extraction.calls == 2
+        assert not YTDLP._in_flight
+        assert not YTDLP._waiting
+
+    asyncio.run(main())
+
+
+def test_cancelled_get_leaves_extraction_to_others(
+    extraction: FakeExtraction,
+) -> None:
+    async def main() -> None:
+        first = asyncio.create_task(YTDLP._get("watch?v=a"))
+        second = asyncio.create_task(YTDLP._get("watch?v=a"))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        await asyncio.sleep(0.01)
+        extraction.release.set()
+
+        assert (await second)[0] == {"id": "watch?v=a"}
+        assert first.cancelled()
+        assert (extraction.calls, extraction.cancelled) == (1, 0)
+
+    asyncio.run(main())
+
+
+def test_extraction_cancelled_with_all_gets(
+    extraction: FakeExtraction,
+) -> None:
+    async def main() -> None:
+        gets = [asyncio.create_task(YTDLP._get("watch?v=a")) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for get in gets:
+            get.cancel()
+        await asyncio.sleep(0.01)
+        assert extraction.cancelled == 1
+        assert not YTDLP._in_flight
+        assert not YTDLP._waiting
+
+    asyncio.run(main())
+
+
+def test_failed_extraction_not_shared_after(
+    extraction: FakeExtraction,
+) -> None:
+    extraction.error = ValueError("failed")
+    extraction.release.set()
+
+    async def main() -> None:
+        gets = [YTDLP._get("watch?v=a") for _ in range(2)]
+        results = await asyncio.gather(*gets, return_exceptions=True)
+        assert all(r is extraction.error for r in results)
+        assert not YTDLP._in_flight
+
+        extraction.error = None
+        assert (await YTDLP._get("watch?v=a"))[0] == {"id": "watch?v=a"}
+        assert extraction.calls == 2
+
+    asyncio.run(main())